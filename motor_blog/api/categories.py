@@ -5,7 +5,8 @@ from bson.objectid import ObjectId
 
 from motor_blog import cache
 from motor_blog.api import coroutine, rpc
-from motor_blog.models import Post, Category, EmbeddedCategory
+from motor_blog.models import (
+    Post, Category, EmbeddedCategory, post_event_info)
 
 
 class Categories(object):
@@ -66,18 +67,27 @@ class Categories(object):
                     categoryName=category['name']))
 
         embedded_cats = [
-            EmbeddedCategory.from_metaweblog(cat).to_python()
-            for cat in categories]
+            EmbeddedCategory.from_metaweblog(cat) for cat in categories]
 
-        result = yield self.settings['db'].posts.update(
+        db = self.settings['db']
+        old_post_doc = yield db.posts.find_one(ObjectId(postid))
+        mod = datetime.datetime.utcnow()
+        result = yield db.posts.update(
             {'_id': ObjectId(postid)},
             {'$set': {
-                'categories': embedded_cats,
-                'mod': datetime.datetime.utcnow(),
+                'categories': [cat.to_python() for cat in embedded_cats],
+                'mod': mod,
             }})
 
-        if result['n'] != 1:
+        if result['n'] != 1 or not old_post_doc:
             self.result(xmlrpclib.Fault(404, 'Not found'))
         else:
+            old_post = Post(**old_post_doc)
+            new_post = Post(**old_post_doc)
+            new_post.categories = embedded_cats
+            new_post.mod = mod
+            yield cache.event(
+                'post_changed',
+                posts=[post_event_info(new_post, old_post)])
+
             self.result('')
-            cache.event('post_changed')
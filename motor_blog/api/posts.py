@@ -8,7 +8,7 @@ from bson.objectid import ObjectId
 
 from motor_blog import cache
 from motor_blog.api import coroutine, rpc
-from motor_blog.models import Post
+from motor_blog.models import Post, post_event_info
 
 
 class Posts(object):
@@ -41,9 +41,13 @@ class Posts(object):
             new_post.pub_date = datetime.datetime.utcnow()
 
         _id = yield self.settings['db'].posts.insert(new_post.to_python())
+        new_post.id = _id
 
+        # Wait for this process to receive the event. Unless events are
+        # coalesced, caches are invalidated by then, so the new post is
+        # visible as soon as we respond.
+        yield cache.event('post_created', posts=[post_event_info(new_post)])
         self.result(str(_id))
-        cache.event('post_created')
 
     @rpc
     def metaWeblog_newPost(self, blogid, user, password, struct, publish):
@@ -90,9 +94,18 @@ class Posts(object):
 
                     yield db.posts.insert(redirect_post.to_python())
 
+                # Fields the update left unchanged.
+                new_post.id = old_post.id
+                new_post.pub_date = new_post.pub_date or old_post.pub_date
+                if not new_post.categories:
+                    new_post.categories = old_post.categories
+
                 # Done
+                yield cache.event(
+                    'post_changed',
+                    posts=[post_event_info(new_post, old_post)])
+
                 self.result(True)
-                cache.event('post_changed')
 
     @rpc
     def metaWeblog_editPost(self, postid, user, password, struct, publish):
@@ -125,13 +138,18 @@ class Posts(object):
     @coroutine
     def _delete_post(self, postid):
         # TODO: a notion of 'trashed', not removed
-        result = yield self.settings['db'].posts.remove(ObjectId(postid))
+        db = self.settings['db']
+        old_post_doc = yield db.posts.find_one(ObjectId(postid))
+        result = yield db.posts.remove(ObjectId(postid))
 
-        if result['n'] != 1:
+        if result['n'] != 1 or not old_post_doc:
             self.result(xmlrpclib.Fault(404, "Not found"))
         else:
+            yield cache.event(
+                'post_deleted',
+                posts=[post_event_info(old=Post(**old_post_doc))])
+
             self.result(True)
-            cache.event('post_deleted')
 
     @rpc
     def blogger_deletePost(self, appkey, postid, user, password, publish):
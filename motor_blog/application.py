@@ -7,13 +7,18 @@ from motor.web import GridFSHandler
 from tornado.web import StaticFileHandler
 
 from motor_blog.api.handlers import APIHandler, RSDHandler
-from motor_blog.web import get_url_spec
+from motor_blog.web import (
+    get_url_spec, fragment_cache, page_cache, templates)
 from motor_blog.web.admin import *
-from motor_blog.web.feed import FeedHandler
+from motor_blog.web.feed import FeedHandler, FORMATS, feed_url_name
 from motor_blog.web.handlers import *
 from motor_blog.web.lytics import TrackingPixelHandler
 
 
+def get_template_path(option_parser):
+    return os.path.join(option_parser.theme, 'templates')
+
+
 def get_application(root_dir, db, option_parser):
     base_url = option_parser.base_url
     static_path = os.path.join(option_parser.theme, 'static')
@@ -22,6 +27,24 @@ def get_application(root_dir, db, option_parser):
     sock_js_router = sockjs.tornado.SockJSRouter(
         DraftReloadConnection, '/blog/sock_js')
 
+    # Feeds of recent posts, a category, or a tag, in each format. Before
+    # CategoryHandler's and TagHandler's URLs, which match anything after
+    # "category/" or "tag/".
+    feed_urls = []
+    for format in FORMATS:
+        path = 'feed/?' if format == 'atom' else 'feed/%s/?' % format
+        feed_urls += [
+            U(
+                path, FeedHandler, {'format': format},
+                name=feed_url_name(None, format)),
+            U(
+                r"category/(?P<slug>.+)/" + path, FeedHandler,
+                {'format': format}, name=feed_url_name('category', format)),
+            U(
+                r"tag/(?P<tag>.+)/" + path, FeedHandler,
+                {'format': format}, name=feed_url_name('tag', format)),
+        ]
+
     urls = [
         # XML-RPC API
         U(r"/rsd", RSDHandler, name='rsd'),
@@ -50,13 +73,14 @@ def get_application(root_dir, db, option_parser):
 
         U(r"admin/media/?", MediaPageHandler, name='media-page'),
         U(r"admin/media/delete", DeleteMediaHandler, name='delete-media'),
+        U(r"admin/views/?", ViewsAdminHandler, name='views-page'),
         U(
             r"admin/static/(.+)",
             StaticFileHandler, {"path": admin_static_path}),
 
-        # Atom
-        U(r"feed/?", FeedHandler, name='feed'),
-        U(r"category/(?P<slug>.+)/feed/?", FeedHandler, name='category-feed'),
+
+        # Atom, RSS, and JSON Feed
+    ] + feed_urls + [
 
         # Web
         U(r"media/(.+)", GridFSHandler, {"database": db}, name='media'),
@@ -84,6 +108,12 @@ def get_application(root_dir, db, option_parser):
         U(r"search/", SearchHandler, name='search'),
     ]
 
+    page_cache.configure(
+        option_parser.page_cache_size * 1024 * 1024,
+        option_parser.page_cache_stale_grace)
+
+    fragment_cache.configure(option_parser.fragment_cache_size * 1024 * 1024)
+
     home_slug = option_parser.home_page
     if home_slug:
         urls.append(U(r"/?", HomeHandler, {'slug': home_slug}, name='home'))
@@ -99,7 +129,8 @@ def get_application(root_dir, db, option_parser):
     return tornado.web.Application(
         urls,
         db=db,
-        template_path=os.path.join(option_parser.theme, 'templates'),
+        template_path=get_template_path(option_parser),
+        ui_methods=templates.UI_METHODS,
         tz=pytz.timezone(option_parser.timezone),
         gzip=True,
         **option_parser.as_dict()
@@ -2,13 +2,15 @@
    capped collection to know when to invalidate
 """
 
+import collections
 import copy
 import functools
 import logging
 import sys
 import datetime
+import time
 
-from pymongo import CursorType
+from pymongo import CursorType, ReturnDocument
 from tornado import gen
 
 import pymongo.errors
@@ -16,10 +18,125 @@ from tornado.concurrent import Future
 from tornado.ioloop import IOLoop
 
 
-_cache = {}
 _callbacks = {}
 _db = None
 
+# Sequence number of the latest event received.
+_last_seq = 0
+
+# Map sequence numbers of events inserted by this process to Futures.
+_waiters = {}
+
+# Seconds event() waits for this process to receive an event it inserted.
+EVENT_TIMEOUT = 10
+
+# Processes number events before inserting them, so with several processes
+# an event may arrive shortly after events numbered later. Wait this many
+# seconds for events missing from a small gap before flushing caches.
+GAP_TIMEOUT = 1
+MAX_LATE_EVENTS = 100
+
+# Map sequence numbers of events not received yet to when to stop waiting.
+_missing = {}
+_gap_timeout = None
+
+# Seconds to collect events before running callbacks, see startup().
+_coalesce_window = 0
+
+# Events received during the current window.
+_batch = []
+
+# Inserted by no one: dispatched locally when events may have been missed.
+# Caches register for it to clear themselves.
+FLUSH_EVENT = 'cache_flush'
+
+
+class LRUCache(object):
+    """A mapping bounded by number of entries and / or total size.
+
+    When either limit is exceeded, the least-recently-used entries are
+    evicted. `sizeof` measures a value for the `max_bytes` limit. The
+    optional `on_evict` function is called with the key and value of each
+    entry that is replaced, popped, or evicted, but not when cleared.
+    """
+    def __init__(
+            self, max_entries=None, max_bytes=None, sizeof=len,
+            on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.nbytes = 0
+        self._data = collections.OrderedDict()  # Maps key to (value, size).
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return default
+
+        # Reinsert to mark most-recently used.
+        self._data[key] = value, size
+        return value
+
+    def set(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else and still not fit.
+            return
+
+        self._data[key] = value, size
+        self.nbytes += size
+        self.trim()
+
+    def pop(self, key, default=None):
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return default
+
+        self.nbytes -= size
+        if self.on_evict:
+            self.on_evict(key, value)
+
+        return value
+
+    def peek(self, key, default=None):
+        """Like get(), without marking the entry recently used."""
+        try:
+            return self._data[key][0]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._data.keys()
+
+    def values(self):
+        return [value for value, _ in self._data.values()]
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+    def trim(self):
+        """Evict least-recently-used entries until within limits."""
+        while self._data and (
+                (self.max_entries is not None
+                 and len(self._data) > self.max_entries)
+                or (self.max_bytes is not None
+                    and self.nbytes > self.max_bytes)):
+            key, (value, size) = self._data.popitem(last=False)
+            self.nbytes -= size
+            if self.on_evict:
+                self.on_evict(key, value)
+
 
 @gen.coroutine
 def create_events_collection(db):
@@ -58,82 +175,192 @@ def remove_callback(event_name, callback):
 
 
 @gen.coroutine
-def event(name):
+def event(name, **data):
     """Insert event into events collection.
 
+    Extra keyword arguments are stored in the event document, e.g. the
+    'posts' affected, as described by models.post_event_info().
+
     Returns a Future. Yield it to wait until listeners have responded to the
-    event.
+    event, or if events are coalesced, until this process has received it.
+    If the event isn't received within EVENT_TIMEOUT seconds, e.g. because
+    tailing failed, stop waiting and log a warning.
     """
     assert _db, "Call cache.startup() once before calling event()."
-    # event() is expected to be very rare -- e.g., called from
-    # wp_newCategory. If it becomes more common, this will need work.
-    future = Future()
+    # Number events so listeners can detect missed ones.
+    counter = yield _db.counters.find_one_and_update(
+        {'_id': 'events'},
+        {'$inc': {'seq': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER)
+
+    seq = counter['seq']
+    future = _waiters[seq] = Future()
+    try:
+        doc = {'ts': datetime.datetime.utcnow(), 'name': name, 'seq': seq}
+        doc.update(data)
+        yield _db.events.insert(doc, manipulate=False)  # No need to add _id
 
-    # Ensure future isn't resolved until after other listeners.
-    def event_listener(_):
-        # Unregister this function.
-        remove_callback(name, event_listener)
-        IOLoop.instance().add_callback(
-            functools.partial(future.set_result, None))
+        yield gen.with_timeout(
+            datetime.timedelta(seconds=EVENT_TIMEOUT), future)
+    except gen.TimeoutError:
+        logging.warning(
+            'Event %r, seq %s, not received after %s seconds',
+            name, seq, EVENT_TIMEOUT)
+    finally:
+        _waiters.pop(seq, None)
 
-    on(name, event_listener)
 
-    yield _db.events.insert(
-        {'ts': datetime.datetime.utcnow(), 'name': name},
-        manipulate=False)  # No need to add _id
+def arguments_key(*args, **kwargs):
+    """Make a hashable cache key from a function's arguments.
 
+    Dicts and lists, like MongoDB queries and sort specs, are converted to
+    tuples.
+    """
+    return _freeze(args), _freeze(kwargs)
 
-def cached(key, invalidate_event):
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    else:
+        return value
+
+
+def memoized(
+        invalidate_events, ttl=None, max_entries=None, key=arguments_key):
     """
-    Caching decorator, invalidated when an event is inserted into `events`
-    collection with a certain name.
+    Caching decorator for coroutines, keyed by their arguments. The cache is
+    cleared when an event is inserted into the `events` collection with
+    certain names.
 
     :Parameters:
-        - `key`: Cache key. For now, caching does not depend on arguments to
-           the function.
-        - `invalidate_event`: Clear the cache when this event occurs.
+        - `invalidate_events`: Event name or list of names that clear the
+          cache.
+        - `ttl`: Optional seconds after which an entry expires.
+        - `max_entries`: Optional maximum number of results to store.
+          Results are typically lists of Models, whose memory use is hard to
+          measure, so results aren't limited by size.
+        - `key`: Function that takes the decorated function's arguments and
+          returns a hashable cache key. To memoize a method regardless of
+          `self`, pass something like
+          ``lambda self, *args, **kwargs: arguments_key(*args, **kwargs)``.
+
+    Results aren't kept stale after an invalidation: pages rendered from
+    them would be cached as if they were fresh. Stale pages are served
+    instead, see page_cache.
     """
+    if isinstance(invalidate_events, basestring):
+        invalidate_events = [invalidate_events]
+
+    # Values are (result, expiration time or None).
+    store = LRUCache(max_entries)
+
+    # Map keys to Futures for calls in progress.
+    pending = {}
+
+    # Incremented on each invalidation, so a call that started before an
+    # invalidation doesn't store its result after it, nor share it with
+    # callers that arrive after it.
+    generation = [0]
+
     def invalidate(event):
-        _cache.pop(key, None)
+        generation[0] += 1
+        pending.clear()
+        store.clear()
 
-    on(invalidate_event, invalidate)
+    for event_name in list(invalidate_events) + [FLUSH_EVENT]:
+        on(event_name, invalidate)
 
-    def _cached(fn):
+    def _memoized(fn):
         @gen.coroutine
-        def maybecall(*args, **kwargs):
-            if key in _cache:
-                raise gen.Return(_cache[key])
-            else:
+        def call(cache_key, args, kwargs):
+            start_generation = generation[0]
+            try:
                 result = yield fn(*args, **kwargs)
-                _cache[key] = result
-                raise gen.Return(result)
+            finally:
+                if start_generation == generation[0]:
+                    pending.pop(cache_key, None)
+
+            if start_generation == generation[0]:
+                expiration = time.time() + ttl if ttl else None
+                store.set(cache_key, (result, expiration))
 
+            raise gen.Return(result)
+
+        @functools.wraps(fn)
+        @gen.coroutine
+        def maybecall(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            entry = store.get(cache_key)
+            if entry:
+                result, expiration = entry
+                if expiration is None or expiration > time.time():
+                    raise gen.Return(result)
+
+            # Concurrent misses share one call to fn.
+            future = pending.get(cache_key)
+            if future is None:
+                future = call(cache_key, args, kwargs)
+                if not future.done():
+                    pending[cache_key] = future
+
+            result = yield future
+            raise gen.Return(result)
+
+        maybecall.invalidate = invalidate
         return maybecall
-    return _cached
+    return _memoized
+
+
+def cached(key, invalidate_event):
+    """
+    Caching decorator, invalidated when an event is inserted into `events`
+    collection with a certain name.
+
+    :Parameters:
+        - `key`: Cache key. Caching does not depend on arguments to
+           the function; use memoized() for that.
+        - `invalidate_event`: Clear the cache when this event occurs.
+    """
+    return memoized(invalidate_event, key=lambda *args, **kwargs: key)
 
 
 @gen.coroutine
-def startup(db):
-    global _db
+def startup(db, coalesce_window=0):
+    """Start tailing the events collection.
+
+    If `coalesce_window` is positive, events received within that many
+    seconds of each other are merged: consecutive events with the same name
+    become one, with the 'posts' of all of them. E.g., when MarsEdit saves a post it edits it
+    and then sets its categories, and listeners are notified once.
+    """
+    global _db, _last_seq, _coalesce_window
     if _db:
         # Already started.
         return
 
     _db = db
+    _coalesce_window = coalesce_window
     yield create_events_collection(db)
 
+    # Resume after the latest event. Caches are empty at startup, so events
+    # before it don't matter.
+    latest = yield db.events.find_one(sort=[('$natural', -1)])
+    _last_seq = latest.get('seq', 0) if latest else 0
+
     # Typically the global loop, but it's a different loop in tests.
     loop = db.get_io_loop()
 
     @gen.coroutine
     def tail():
         collection = db.events
-        now = datetime.datetime.utcnow()
-        last_event_ts = None
 
         def make_cursor():
             return collection.find(
-                {'ts': {'$gte': last_event_ts or now}},
+                {'seq': {'$gt': _last_seq}},
                 cursor_type=CursorType.TAILABLE_AWAIT)
 
         cursor = make_cursor()
@@ -142,26 +369,24 @@ def startup(db):
             if not cursor.alive:
                 # While collection is empty, tailable cursor dies immediately.
                 yield gen.Task(loop.add_timeout, datetime.timedelta(seconds=1))
-                logging.debug('new cursor, last_event_ts = %s, now = %s',
-                              last_event_ts, now)
+                logging.debug('new cursor, last_seq = %s', _last_seq)
                 cursor = make_cursor()
 
             try:
                 while (yield cursor.fetch_next):
                     event = cursor.next_object()
                     logging.info(
-                        "Event: %r, %s", event.get('name'), event.get('ts'))
+                        "Event: %r, %s, seq %s",
+                        event.get('name'), event.get('ts'), event.get('seq'))
 
-                    _on_event(event)
-                    last_event_ts = event.get('ts')
+                    _on_tailed_event(event)
             except pymongo.errors.OperationFailure:
                 # Collection dropped?
                 logging.exception('Tailing "events" collection.')
                 yield gen.Task(loop.add_timeout, datetime.timedelta(seconds=1))
                 logging.error(
                     'Resuming tailing "events" collection.'
-                    ' Last_event_ts = %s, now = %s',
-                    last_event_ts, now)
+                    ' last_seq = %s', _last_seq)
 
                 cursor = make_cursor()
 
@@ -173,9 +398,111 @@ def startup(db):
     tail()
 
 
+def _on_tailed_event(event):
+    """Check an event's sequence number, then run callbacks.
+
+    If events were missed, e.g. because the capped collection wrapped around
+    while the cursor was being recreated, flush all caches. Events missing
+    from a small gap may just be late, see GAP_TIMEOUT.
+    """
+    global _last_seq, _gap_timeout
+    seq = event['seq']
+    loop = IOLoop.current()
+    if seq > _last_seq + 1 + MAX_LATE_EVENTS:
+        logging.warning(
+            'Missed events %d through %d, flushing caches',
+            _last_seq + 1, seq - 1)
+
+        _on_event({'name': FLUSH_EVENT, 'seq': seq})
+    elif seq > _last_seq + 1:
+        deadline = loop.time() + GAP_TIMEOUT
+        for missing_seq in range(_last_seq + 1, seq):
+            _missing[missing_seq] = deadline
+
+        if _gap_timeout is None:
+            _gap_timeout = loop.call_at(deadline, _check_gap)
+
+    # A lower seq than _last_seq is an event that was inserted late. Its
+    # callbacks still run.
+    _missing.pop(seq, None)
+    _last_seq = max(_last_seq, seq)
+    if _coalesce_window:
+        if not _batch:
+            loop.add_timeout(
+                datetime.timedelta(seconds=_coalesce_window), _end_batch)
+
+        _batch.append(event)
+    else:
+        _on_event(event)
+
+    future = _waiters.pop(seq, None)
+    if future:
+        # Ensure future isn't resolved until after callbacks.
+        loop.add_callback(functools.partial(future.set_result, None))
+
+
+def _check_gap():
+    """Flush caches if events are still missing after GAP_TIMEOUT."""
+    global _gap_timeout
+    _gap_timeout = None
+    loop = IOLoop.current()
+    missed = sorted(
+        seq for seq, deadline in _missing.items() if deadline <= loop.time())
+
+    if missed:
+        for seq in missed:
+            del _missing[seq]
+
+        logging.warning(
+            'Missed %d events, seq %d through %d, flushing caches',
+            len(missed), missed[0], missed[-1])
+
+        _on_event({'name': FLUSH_EVENT, 'seq': _last_seq})
+
+    if _missing:
+        _gap_timeout = loop.call_at(min(_missing.values()), _check_gap)
+
+
+def _end_batch():
+    events = _batch[:]
+    del _batch[:]
+    for merged in coalesce(events):
+        _on_event(merged)
+
+
+def coalesce(events):
+    """Merge consecutive events with the same name, keeping their order.
+
+    A merged event has the latest 'seq' and 'ts', and the 'posts' of all
+    the events, unless one of them affects everything and has no 'posts'.
+    """
+    merged = []
+    for event in events:
+        if not merged or merged[-1]['name'] != event['name']:
+            merged.append(dict(event))
+            if 'posts' in event:
+                merged[-1]['posts'] = list(event['posts'])
+        else:
+            merged_event = merged[-1]
+            merged_event['seq'] = event.get('seq')
+            merged_event['ts'] = event.get('ts')
+            if 'posts' in merged_event and 'posts' in event:
+                merged_event['posts'].extend(event['posts'])
+            else:
+                merged_event.pop('posts', None)
+
+    return merged
+
+
 def shutdown():
-    global _db
+    global _db, _gap_timeout
     _db = None
+    _waiters.clear()
+    del _batch[:]
+    _missing.clear()
+    if _gap_timeout:
+        IOLoop.current().remove_timeout(_gap_timeout)
+        _gap_timeout = None
 
 
 def _on_event(event):
@@ -10,18 +10,27 @@ def ensure_indexes(db, drop=False):
         yield db.posts.drop_indexes()
         yield db.categories.drop_indexes()
         yield db.events.drop_indexes()
+        yield db.views.drop_indexes()
 
     logging.info('Ensuring indexes...')
 
     yield db.categories.ensure_index([('name', 1)], unique=True)
 
     yield db.posts.ensure_index([('type', 1), ('_id', -1)])
-    yield db.posts.ensure_index([('status', 1), ('type', 1), ('pub_date', -1)])
+    # Post listings are sorted and paged by (pub_date, _id).
     yield db.posts.ensure_index(
-        [('status', 1), ('type', 1), ('categories.name', 1), ('pub_date', -1)])
+        [('status', 1), ('type', 1), ('pub_date', -1), ('_id', -1)])
 
     yield db.posts.ensure_index(
-        [('status', 1), ('type', 1), ('tags', 1), ('pub_date', -1)])
+        [('status', 1), ('type', 1), ('categories.name', 1), ('pub_date', -1)])
+
+    yield db.posts.ensure_index([
+        ('status', 1), ('type', 1), ('categories.slug', 1), ('pub_date', -1),
+        ('_id', -1)])
+
+    yield db.posts.ensure_index([
+        ('status', 1), ('type', 1), ('tags', 1), ('pub_date', -1),
+        ('_id', -1)])
 
     yield db.posts.ensure_index([('slug', 1)], unique=True)
     yield db.posts.ensure_index([('tags', 1), ('pub_date', -1)])
@@ -35,4 +44,8 @@ def ensure_indexes(db, drop=False):
 
     yield db.fs.files.ensure_index([('uploadDate', 1)])
 
+    # View counts are upserted by path and day, and summed since a day.
+    yield db.views.ensure_index([('path', 1), ('day', 1)], unique=True)
+    yield db.views.ensure_index([('day', 1)])
+
     logging.info('    done.')
@@ -10,6 +10,7 @@ from motor_blog.text.link import absolute
 
 import pytz
 from motor_blog.text import markup, summarize, slugify, plain
+from motor_blog.text import markdown_widget_extension
 
 utc_tz = pytz.timezone('UTC')
 
@@ -76,6 +77,8 @@ class Post(BlogDocument):
     title = StringField(default='')
     # Formatted for display.
     body = StringField(default='')
+    # Body split around widgets: HTML, widget, HTML, ... or empty if none.
+    segments = ListField(StringField())
     # Input from MarsEdit or migrate_from_wordpress.
     original = StringField(default='')
     # Plain text.
@@ -97,6 +100,24 @@ class Post(BlogDocument):
     # Post was moved, this is its new slug.
     redirect = StringField(default=None)
 
+    # Fields to query for each way of showing posts; see projection().
+    projections = {
+        # Everything shown on a post's own page, or in feeds. post.jade is
+        # cached for all pages that show it, so it includes the summary.
+        'full': {'original': False, 'plain': False},
+        # Posts with full content on the home page, categories, and tags.
+        'list': dict.fromkeys([
+            'title', 'slug', 'type', 'status', 'pub_date', 'mod',
+            'meta_description', 'summary', 'body', 'segments'], True),
+        # Titles and excerpts, like on the All Posts page.
+        'summary': dict.fromkeys([
+            'title', 'slug', 'type', 'status', 'pub_date', 'mod',
+            'meta_description', 'summary'], True),
+        # Links to the previous and next posts.
+        'nav': dict.fromkeys([
+            'title', 'slug', 'type', 'pub_date', 'mod'], True),
+    }
+
     def __init__(self, *args, **kwargs):
         super(Post, self).__init__(*args, **kwargs)
         if not self.mod.tzinfo:
@@ -146,6 +167,7 @@ class Post(BlogDocument):
             title=title,
             # Format for display
             body=body,
+            segments=markdown_widget_extension.segments(body),
             plain=plain.plain(body),
             summary=summarize.summarize(body, 200),
             original=description,
@@ -167,6 +189,11 @@ class Post(BlogDocument):
 
         return rv
 
+    @classmethod
+    def projection(cls, profile):
+        """MongoDB projection for 'full', 'list', 'summary', or 'nav'."""
+        return cls.projections[profile]
+
     def to_metaweblog(self, application):
         # We're kind of throwing fieldnames at the wall and seeing what sticks,
         # MarsEdit expects different names in the responses to different API
@@ -256,3 +283,24 @@ class Post(BlogDocument):
                 return True
 
         return False
+
+
+def post_event_info(new=None, old=None):
+    """Describe a post's change for an event document.
+
+    Pass the post as it is after the change, before it, or both. Listeners
+    use the result to evict only cached pages that show this post.
+    """
+    either = new or old
+    info = {'id': either.id, 'type': either.type}
+    for prefix, post in (('', new), ('old_', old)):
+        info[prefix + 'slug'] = post.slug if post else None
+        info[prefix + 'title'] = post.title if post else None
+        info[prefix + 'status'] = post.status if post else None
+        info[prefix + 'pub_date'] = post.pub_date if post else None
+        info[prefix + 'mod'] = post.mod if post else None
+        info[prefix + 'tags'] = list(post.tags or []) if post else []
+        info[prefix + 'categories'] = [
+            category.slug for category in post.categories] if post else []
+
+    return info
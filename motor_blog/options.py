@@ -24,12 +24,56 @@ def define_options(option_parser):
     option_parser.define('cookie_secret', type=str, group='Application')
     option_parser.define('port', default=8888, type=int, help=(
         "Server port"), group='Application')
+    option_parser.define('processes', default=1, type=int, help=(
+        "Worker processes to fork, 0 for one per CPU"), group='Application')
+    option_parser.define('reuse_port', default=False, type=bool, help=(
+        "Each worker listens on its own socket with SO_REUSEPORT"),
+        group='Application')
 
     # Startup
     option_parser.define('ensure_indexes', default=False, type=bool, help=(
         "Ensure collection indexes before starting"), group='Startup')
     option_parser.define('rebuild_indexes', default=False, type=bool, help=(
         "Drop all indexes and recreate before starting"), group='Startup')
+    option_parser.define('template_module_dir', type=str, help=(
+        "Directory to save templates' generated Python code in, so later"
+        " startups skip compiling them"), group='Startup')
+
+    # Cache
+    option_parser.define('page_cache_size', default=64, type=int, help=(
+        "Megabytes of rendered pages to cache in memory, 0 to disable"),
+        group='Cache')
+    option_parser.define('fragment_cache_size', default=16, type=int, help=(
+        "Megabytes of rendered posts to reuse on list pages, 0 to disable"),
+        group='Cache')
+    option_parser.define('event_coalesce_window', default=0, type=float, help=(
+        "Seconds to collect events, e.g. from one MarsEdit save, and notify"
+        " listeners once. Changes may take this long to appear after"
+        " MarsEdit's request returns"), group='Cache')
+    option_parser.define('page_cache_stale_grace', default=0, type=int, help=(
+        "Seconds to serve an invalidated page while it's re-rendered, or if"
+        " re-rendering fails"), group='Cache')
+    option_parser.define('cache_control', default={}, type=dict, help=(
+        "Override Cache-Control policies 'list', 'post', 'feed', 'search'"
+        " and 'private', e.g. {'post': {'max_age': 60, 's_maxage': 600}}"),
+        group='Cache')
+    option_parser.define('purge_endpoints', default=[], type=list, help=(
+        "Front proxy URLs like 'http://127.0.0.1:6081' to send purge"
+        " requests to when posts change"), group='Cache')
+    option_parser.define('purge_by_url', default=False, type=bool, help=(
+        "Purge each changed page's URL, instead of by Surrogate-Key."
+        " After a flush only the hottest pages are purged"),
+        group='Cache')
+    option_parser.define('purge_method', default='PURGE', type=str, help=(
+        "HTTP method of purge requests, like PURGE or BAN"), group='Cache')
+    option_parser.define('warm_pages', default=5, type=int, help=(
+        "Pages of recent posts to render into the page cache at startup and"
+        " after changes, along with categories and feeds"), group='Cache')
+    option_parser.define('warm_tags', default=10, type=int, help=(
+        "How many of the most-used tags' pages to render in advance"),
+        group='Cache')
+    option_parser.define('warm_concurrency', default=2, type=int, help=(
+        "Pages to render in advance at once, 0 to disable"), group='Cache')
 
     # Identity
     option_parser.define('mongo_uri', default='mongodb://localhost:27017/motorblog', type=str,
@@ -58,6 +102,24 @@ def define_options(option_parser):
 
     option_parser.define('google_analytics_rss_id', type=str, help=(
         "Like 'UA-123456-1'"), group='Integrations')
+    option_parser.define('count_views', default=False, type=bool, help=(
+        "Count views of each page per day in MongoDB, from feed readers'"
+        " tracking pixels"), group='Integrations')
+    option_parser.define('count_page_views', default=False, type=bool, help=(
+        "Also count views of web pages, if count_views"),
+        group='Integrations')
+    option_parser.define('view_count_interval', default=60, type=int, help=(
+        "Seconds between saving view counts"), group='Integrations')
+    option_parser.define('ranking_interval', default=600, type=int, help=(
+        "Seconds between ranking posts by views, for the popular-posts"
+        " widget"), group='Integrations')
+    option_parser.define(
+        'analytics_batch_uri', default='https://www.google-analytics.com/batch',
+        type=str, help="Where to send batches of feed-view events",
+        group='Integrations')
+    option_parser.define('analytics_queue_size', default=10000, type=int, help=(
+        "Feed-view events to queue for sending before dropping them"),
+        group='Integrations')
 
     # Admin
     option_parser.define('user', type=str, group='Admin')
@@ -91,6 +153,10 @@ def check_required_options(option_parser):
 
             raise tornado.options.Error(message)
 
+    if option_parser.processes != 1 and option_parser.autoreload:
+        raise tornado.options.Error(
+            'autoreload and debug require processes = 1')
+
 
 def enable_debug(option_parser, debug):
     if debug:
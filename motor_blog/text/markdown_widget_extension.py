@@ -1,9 +1,14 @@
+import re
+
 import markdown.inlinepatterns
 from markdown.util import etree, AtomicString
 
 
 WIDGET_RE = r'\!\!(.*?)\!\!'  # Like !!widget option option!!
 
+# Widgets in HTML, after WidgetPattern.
+widget_html_pat = re.compile(r'<widget>(.*?)</widget>', re.MULTILINE)
+
 
 class WidgetPattern(markdown.inlinepatterns.Pattern):
     """Return <widget>text</widget>."""
@@ -18,3 +23,14 @@ class WidgetExtension(markdown.Extension):
     """Widget Extension for Python-Markdown."""
     def extendMarkdown(self, md, md_globals):
         md.inlinePatterns['widget'] = WidgetPattern(WIDGET_RE, md)
+
+
+def segments(html):
+    """Split HTML around widgets.
+
+    Returns a list alternating HTML and widget text, like
+    ['<p>', 'recent-posts 10', '</p>'], or an empty list if there are no
+    widgets.
+    """
+    parts = widget_html_pat.split(html)
+    return parts if len(parts) > 1 else []
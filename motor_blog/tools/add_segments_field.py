@@ -0,0 +1,37 @@
+"""Go through old posts and pages and add a "segments" field with the body
+split around widgets. Not needed for new posts, which have "segments" added
+when they're created or edited. Optional: posts without segments are split
+each time they're rendered, if they have widgets, and this saves the work.
+"""
+
+import argparse
+import pymongo
+from motor_blog.text.markdown_widget_extension import segments
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Add a segments field to all posts and pages',
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    db = pymongo.MongoClient().motorblog
+
+    print (
+        'Updating all', db.posts.count(), 'posts')
+
+    print
+
+    for post in db.posts.find({}, {'title': 1, 'type': 1, 'body': 1}):
+        print post['title'], post['type']
+        db.posts.update_one(
+            {'_id': post['_id']},
+            {'$set': {'segments': segments(post.get('body', ''))}})
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -1,6 +1,7 @@
 import datetime
 import json
 import logging
+import os
 from urllib import urlencode
 
 import tornado.web
@@ -12,6 +13,7 @@ from tornado.options import options as opts
 
 from motor_blog import cache
 from motor_blog.models import Post, Category, GuestAccessToken
+from motor_blog.web import view_counts
 from motor_blog.web.handlers import MotorBlogHandler
 
 __all__ = (
@@ -21,8 +23,12 @@ __all__ = (
     'AddDraftGuestAccessTokenHandler', 'DeleteDraftGuestAccessTokenHandler',
     'DraftReloadConnection',
     'MediaPageHandler', 'DeleteMediaHandler',
+    'ViewsAdminHandler',
 )
 
+# Admin templates are in admin-templates/ here.
+ADMIN_TEMPLATE_PATH = os.path.dirname(os.path.abspath(__file__))
+
 # TODO: what's the login timeout?
 # TODO: can MarsEdit preview a draft of an *edit* of a published post?
 
@@ -31,7 +37,7 @@ class MotorBlogAdminHandler(MotorBlogHandler):
     def get_template_path(self):
         """Don't use theme template path
         """
-        return None
+        return ADMIN_TEMPLATE_PATH
 
 
 class LoginHandler(MotorBlogAdminHandler):
@@ -167,7 +173,8 @@ class DeleteCategoryHandler(MotorBlogAdminHandler):
             multi=True)
 
         # Yield and wait for listeners to run before redirecting, so there's
-        # a good chance the categories page will reload the categories.
+        # a good chance the categories page will reload the categories. If
+        # events are coalesced, listeners run up to a window later.
         yield cache.event('categories_changed')
         self.redirect(self.reverse_url('categories-page'))
 
@@ -180,8 +187,7 @@ class DraftHandler(MotorBlogHandler):
         slug = slug.rstrip('/')
         guest_access_token = self.get_argument('guest-access-token', None)
         postdoc = yield self.settings['db'].posts.find_one(
-            {'slug': slug},
-            {'summary': False, 'original': False})
+            {'slug': slug}, Post.projection('full'))
 
         if not postdoc:
             raise tornado.web.HTTPError(404)
@@ -245,8 +251,8 @@ class DraftReloadConnection(sockjs.tornado.SockJSConnection):
         the latest version we must check at the end of each page-load whether
         we're still up to date.
 
-        # TODO: might reduce flickering by waiting a second to see if we'll
-            change again, before sending post_changed.
+        Set the event_coalesce_window option to reduce flickering: the two
+        events are merged and browsers are told to reload once.
         """
         try:
             # The client tells us this page's last-modified date.
@@ -296,3 +302,17 @@ class DeleteMediaHandler(MotorBlogAdminHandler):
         fs = yield motor.MotorGridFS(self.settings['db']).open()
         yield fs.delete(ObjectId(media_id))
         self.redirect(self.reverse_url('media-page'))
+
+
+class ViewsAdminHandler(MotorBlogAdminHandler):
+    """Show the most-viewed pages in the last `days` days."""
+    @gen.coroutine
+    @tornado.web.addslash
+    @tornado.web.authenticated
+    def get(self):
+        days = int(self.get_argument('days', 30))
+        since = view_counts.today() - datetime.timedelta(days=days - 1)
+        views = yield view_counts.views(
+            self.settings['db'], since=since, limit=100)
+
+        self.render('admin-templates/views.html', views=views, days=days)
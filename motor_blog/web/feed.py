@@ -1,34 +1,248 @@
-"""Serve RSS feed.
+"""Serve Atom, RSS 2.0 and JSON Feed feeds.
+
+There are feeds of recent posts, and of each category and tag, in each
+format. Every format is assembled from entries serialized once per post and
+kept in the fragment cache, so serving another format costs little.
+
+Feeds are kept in the page cache like other pages, labeled with the
+category, tag, or the list of recent posts and the posts they include, so
+the same post and category events evict them. If the page cache is disabled,
+feeds are streamed to the client as they're generated.
 """
 
+import calendar
 import datetime
+import email.utils
+import json
+from collections import OrderedDict
 
+import pytz
 import tornado.web
 from tornado import gen
+from tornado.escape import utf8, xhtml_escape
 from tornado.options import options as opts
-from werkzeug.contrib.atom import AtomFeed
 
 from motor_blog.text.link import absolute
+from motor_blog.web import fragment_cache, page_cache
 from motor_blog.web.handlers import MotorBlogHandler
 from motor_blog.web.lytics import ga_track_event_url
 
 
-__all__ = ('FeedHandler',)
+__all__ = ('FeedHandler', 'FORMATS', 'feed_url_name')
+
+# When streaming, flush after generating this many bytes.
+STREAM_CHUNK_SIZE = 16 * 1024
+
+GENERATOR = ('Motor-Blog', 'https://github.com/ajdavis/motor-blog', '0.1')
+
+
+def feed_url_name(kind, format):
+    """Name of a feed's URL, like 'feed', 'category-feed-rss' or
+    'tag-feed-json'. `kind` is None, 'category' or 'tag'.
+    """
+    name = '%s-feed' % kind if kind else 'feed'
+    return name if format == 'atom' else '%s-%s' % (name, format)
+
+
+def _iso8601(dt):
+    return dt.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _rfc822(dt):
+    return email.utils.formatdate(
+        calendar.timegm(dt.utctimetuple()), usegmt=True)
+
+
+class AtomFormat(object):
+    content_type = 'application/atom+xml; charset=UTF-8'
+    separator = ''
+
+    def head(self, feed):
+        author = feed['author']
+        return (
+            u'<?xml version="1.0" encoding="utf-8"?>\n'
+            u'<feed xmlns="http://www.w3.org/2005/Atom">\n'
+            u'  <title type="text">%s</title>\n'
+            u'  <id>%s</id>\n'
+            u'  <updated>%s</updated>\n'
+            u'  <link href="%s" />\n'
+            u'  <link href="%s" rel="self" />\n'
+            u'  <author>\n'
+            u'    <name>%s</name>\n'
+            u'    <email>%s</email>\n'
+            u'  </author>\n'
+            u'  <icon>%s</icon>\n'
+            u'  <generator uri="%s" version="%s">%s</generator>\n' % (
+                xhtml_escape(feed['title']),
+                xhtml_escape(feed['feed_url']),
+                _iso8601(feed['updated']),
+                xhtml_escape(feed['home_url']),
+                xhtml_escape(feed['feed_url']),
+                xhtml_escape(author['name']),
+                xhtml_escape(author['email']),
+                xhtml_escape(feed['icon']),
+                GENERATOR[1], GENERATOR[2], GENERATOR[0]))
+
+    def entry(self, entry):
+        author = entry['author']
+        if entry['summary']:
+            summary = u'    <summary type="html">%s</summary>\n' % (
+                xhtml_escape(entry['summary']))
+        else:
+            summary = u''
+
+        return (
+            u'  <entry xml:base="%s">\n'
+            u'    <title type="text">%s</title>\n'
+            u'    <id>%s</id>\n'
+            u'    <updated>%s</updated>\n'
+            u'    <published>%s</published>\n'
+            u'    <link href="%s" />\n'
+            u'    <author>\n'
+            u'      <name>%s</name>\n'
+            u'      <email>%s</email>\n'
+            u'    </author>\n'
+            u'%s'
+            u'    <content type="html">%s</content>\n'
+            u'  </entry>\n' % (
+                xhtml_escape(entry['url']),
+                xhtml_escape(entry['title']),
+                xhtml_escape(entry['url']),
+                # Don't use the post's mod date: it seems to make Planet
+                # Python re-post my updated items, which is spammy.
+                _iso8601(entry['published']),
+                _iso8601(entry['published']),
+                xhtml_escape(entry['url']),
+                xhtml_escape(author['name']),
+                xhtml_escape(author['email']),
+                summary,
+                xhtml_escape(entry['content'])))
+
+    def tail(self, feed):
+        return u'</feed>\n'
+
+
+class RSSFormat(object):
+    content_type = 'application/rss+xml; charset=UTF-8'
+    separator = ''
+
+    def head(self, feed):
+        return (
+            u'<?xml version="1.0" encoding="utf-8"?>\n'
+            u'<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">\n'
+            u'<channel>\n'
+            u'  <title>%s</title>\n'
+            u'  <link>%s</link>\n'
+            u'  <description>%s</description>\n'
+            u'  <atom:link href="%s" rel="self"'
+            u' type="application/rss+xml" />\n'
+            u'  <lastBuildDate>%s</lastBuildDate>\n'
+            u'  <generator>%s</generator>\n'
+            u'  <image>\n'
+            u'    <url>%s</url>\n'
+            u'    <title>%s</title>\n'
+            u'    <link>%s</link>\n'
+            u'  </image>\n' % (
+                xhtml_escape(feed['title']),
+                xhtml_escape(feed['home_url']),
+                xhtml_escape(feed['description']),
+                xhtml_escape(feed['feed_url']),
+                _rfc822(feed['updated']),
+                GENERATOR[0],
+                xhtml_escape(feed['icon']),
+                xhtml_escape(feed['title']),
+                xhtml_escape(feed['home_url'])))
+
+    def entry(self, entry):
+        author = entry['author']
+        return (
+            u'  <item>\n'
+            u'    <title>%s</title>\n'
+            u'    <link>%s</link>\n'
+            u'    <guid isPermaLink="true">%s</guid>\n'
+            u'    <pubDate>%s</pubDate>\n'
+            u'    <author>%s (%s)</author>\n'
+            u'    <description>%s</description>\n'
+            u'  </item>\n' % (
+                xhtml_escape(entry['title']),
+                xhtml_escape(entry['url']),
+                xhtml_escape(entry['url']),
+                _rfc822(entry['published']),
+                xhtml_escape(author['email']),
+                xhtml_escape(author['name']),
+                xhtml_escape(entry['content'])))
+
+    def tail(self, feed):
+        return u'</channel>\n</rss>\n'
+
+
+class JSONFormat(object):
+    content_type = 'application/feed+json; charset=UTF-8'
+    separator = ',\n'
+
+    def head(self, feed):
+        head = json.dumps(OrderedDict([
+            ('version', 'https://jsonfeed.org/version/1'),
+            ('title', feed['title']),
+            ('home_page_url', feed['home_url']),
+            ('feed_url', feed['feed_url']),
+            ('description', feed['description']),
+            ('icon', feed['icon']),
+            ('author', {'name': feed['author']['name']}),
+        ]))
+
+        # Leave the object open for the items.
+        return head[:-1] + ', "items": [\n'
+
+    def entry(self, entry):
+        item = OrderedDict([
+            ('id', entry['url']),
+            ('url', entry['url']),
+            ('title', entry['title']),
+            ('content_html', entry['content']),
+        ])
+
+        # Optional, and not for an empty string.
+        if entry['summary']:
+            item['summary'] = entry['summary']
+
+        item['date_published'] = _iso8601(entry['published'])
+        return json.dumps(item)
+
+    def tail(self, feed):
+        return u'\n]}\n'
+
+
+# Map format names, as in URLs, to formats.
+FORMATS = OrderedDict([
+    ('atom', AtomFormat()),
+    ('rss', RSSFormat()),
+    ('json', JSONFormat()),
+])
 
 
 class FeedHandler(MotorBlogHandler):
+    cacheable = True
+    cache_policy = 'feed'
+
+    def initialize(self, format='atom'):
+        self.format = FORMATS[format]
+        self.format_name = format
+
     @gen.coroutine
-    def get(self, slug=None):
+    def get(self, slug=None, tag=None):
         if slug:
             slug = slug.rstrip('/')
 
+        if tag:
+            tag = tag.rstrip('/')
+
         this_category = None
         categories = yield self.get_categories()
         if slug:
             # Get all the categories and search for one with the right slug,
             # instead of actually querying for the right category, since
             # get_categories() is cached.
-            slug = slug.rstrip('/')
             for category in categories:
                 if category.slug == slug:
                     this_category = category
@@ -37,71 +251,127 @@ class FeedHandler(MotorBlogHandler):
                 raise tornado.web.HTTPError(404)
 
         title = opts.blog_name
-
+        posts_query = {'status': 'publish', 'type': 'post'}
         if this_category:
             title = '%s - Posts about %s' % (title, this_category.name)
+            feed_url = self.reverse_url(
+                feed_url_name('category', self.format_name), slug)
 
-        author = {'name': opts.author_display_name, 'email': opts.author_email}
-        if this_category:
-            feed_url = absolute(
-                self.reverse_url('category-feed', this_category.slug))
-        else:
-            feed_url = absolute(self.reverse_url('feed'))
-
-        posts_query = {'status': 'publish', 'type': 'post'}
-        if slug:
-            slug = slug.rstrip('/')
             posts_query['categories.slug'] = slug
+            self.add_surrogate_keys(page_cache.category_key(slug))
+        elif tag:
+            title = '%s - Posts tagged %s' % (title, tag)
+            feed_url = self.reverse_url(
+                feed_url_name('tag', self.format_name), tag)
+
+            posts_query['tags'] = tag
+            self.add_surrogate_keys(page_cache.tag_key(tag))
+        else:
+            feed_url = self.reverse_url(feed_url_name(None, self.format_name))
+            self.add_surrogate_keys(page_cache.LIST_KEY)
 
         posts = yield self.get_posts(
             posts_query,
-            {'summary': False, 'original': False},
+            'full',
             [('pub_date', -1)],
             0,
             20)
 
+        self.add_post_keys(*posts)
+        self.update_last_mod_from_list(posts)
         if posts:
-            updated = max(max(p.mod, p.date_created) for p in posts)
+            updated = self._last_modified
         else:
             updated = datetime.datetime.now(tz=self.application.settings['tz'])
 
-        icon = absolute(
-            self.reverse_url('theme-static', '/theme/static/square96.png'))
-
-        generator = (
-            'Motor-Blog', 'https://github.com/ajdavis/motor-blog', '0.1')
-
-        feed = AtomFeed(
-            title=title,
-            feed_url=feed_url,
-            url=absolute(self.reverse_url('home')),
-            author=author,
-            updated=updated,
-            # TODO: customizable icon, also a 'logo' kwarg
-            icon=icon,
-            generator=generator)
-
-        for post in posts:
-            url = absolute(self.reverse_url('post', post.slug))
-            tracking_pixel_url = ga_track_event_url(self.application, url)
-            tracking_pixel = '<img src="%s" width="1px" height="1px">' \
-                % tracking_pixel_url
-
-            feed.add(
-                title=post.title,
-                content=post.body + tracking_pixel,
-                content_type='html',
-                summary=post.summary,
-                author=author,
-                url=url,
-                id=url,
-                published=post.date_created,
-                # Don't update 'updated' - it seems to make Planet Python
-                # re-post my updated items, which is spammy.
-                #updated=post.mod,
-                updated=post.date_created,
-            )
-
-        self.set_header('Content-Type', 'application/atom+xml; charset=UTF-8')
-        self.write(unicode(feed))
+        feed = {
+            'title': title,
+            'description': opts.description or '',
+            'feed_url': absolute(feed_url),
+            'home_url': absolute(self.reverse_url('home')),
+            'author': self.author(),
+            'updated': updated,
+            # TODO: customizable icon
+            'icon': absolute(self.reverse_url(
+                'theme-static', '/theme/static/square96.png')),
+        }
+
+        chunks = (utf8(chunk) for chunk in self.generate(feed, posts))
+        if page_cache.enabled() and self.get_status() == 200:
+            page = page_cache.CachedPage(
+                ''.join(chunks), self._last_modified, self._surrogate_keys,
+                content_type=self.format.content_type)
+
+            page_cache.put(
+                self.page_cache_key(), page, self._page_cache_generation)
+
+            self.finish_cached_page(page)
+            return
+
+        self.set_header('Content-Type', self.format.content_type)
+        self.set_surrogate_key_header()
+        self.set_last_modified_header()
+        if self.is_not_modified():
+            self.set_status(304)
+            self.finish()
+            return
+
+        yield self.stream(chunks)
+
+    def author(self):
+        return {
+            'name': opts.author_display_name or '',
+            'email': opts.author_email or ''}
+
+    def generate(self, feed, posts):
+        """Yield pieces of the feed."""
+        yield self.format.head(feed)
+        for i, post in enumerate(posts):
+            if i:
+                yield self.format.separator
+
+            yield self.serialized_entry(post)
+
+        yield self.format.tail(feed)
+
+    def serialized_entry(self, post):
+        """A post's entry in this handler's format, cached until it changes.
+        """
+        key = fragment_cache.fragment_key(
+            '%s-entry' % self.format_name, post, self.settings['tz'])
+
+        serialized = fragment_cache.get(key)
+        if serialized is None:
+            serialized = utf8(self.format.entry(self.entry(post)))
+            if fragment_cache.enabled():
+                fragment_cache.put(key, serialized)
+
+        return serialized
+
+    def entry(self, post):
+        url = absolute(self.reverse_url('post', post.slug))
+        tracking_pixel_url = ga_track_event_url(self.application, url)
+        tracking_pixel = '<img src="%s" width="1px" height="1px">' \
+            % tracking_pixel_url
+
+        return {
+            'title': post.title,
+            'url': url,
+            'content': post.body + tracking_pixel,
+            'summary': post.summary,
+            'author': self.author(),
+            'published': post.date_created,
+        }
+
+    @gen.coroutine
+    def stream(self, chunks):
+        """Write chunks of the feed, flushing as they accumulate."""
+        buffered = 0
+        for chunk in chunks:
+            self.write(chunk)
+            buffered += len(chunk)
+            if buffered >= STREAM_CHUNK_SIZE:
+                buffered = 0
+                yield self.flush()
+
         self.finish()
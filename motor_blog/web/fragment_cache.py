@@ -0,0 +1,54 @@
+"""In-memory cache of rendered template fragments, like one post's HTML.
+
+List pages render the same post with the same template over and over. A
+post's fragment changes only when the post does, so fragments are keyed by
+the template, the post's id and modification date, and the timezone its
+dates are shown in. An edited post has a new modification date and misses
+the cache; its old fragments age out of the LRU.
+
+Pages must load each post with all the fields its template shows, since
+the fragment cached for one page is reused by others.
+
+Events that don't say which posts changed, like a flush, clear the cache.
+"""
+
+from tornado.escape import utf8
+
+from motor_blog import cache
+
+__all__ = ('configure', 'enabled', 'fragment_key', 'get', 'put')
+
+_fragments = cache.LRUCache(max_bytes=16 * 1024 * 1024, sizeof=len)
+
+
+def fragment_key(template_name, post, tz):
+    return template_name, post.id, post.mod, tz.zone
+
+
+def configure(max_bytes):
+    """Set the memory limit. Zero disables caching fragments."""
+    _fragments.max_bytes = max_bytes
+    _fragments.trim()
+
+
+def enabled():
+    return _fragments.max_bytes > 0
+
+
+def get(key):
+    """Rendered HTML, or None."""
+    return _fragments.get(key)
+
+
+def put(key, html):
+    _fragments.set(key, utf8(html))
+
+
+def _on_event(event):
+    if 'posts' not in event:
+        _fragments.clear()
+
+
+for _event_name in (
+        'post_created', 'post_changed', 'post_deleted', cache.FLUSH_EVENT):
+    cache.on(_event_name, _on_event)
@@ -1,17 +1,22 @@
 """Web frontend for motor-blog: actually show web pages to visitors
 """
 
+import calendar
 import datetime
 import email.utils
 import time
+import urllib
 
 import tornado.web
+from bson import ObjectId
+from bson.errors import InvalidId
 from tornado import gen
 
 from motor_blog.models import Post, Category
 from motor_blog import cache, models
-from motor_blog.text.link import absolute
-from motor_blog.web.widgets import process_widgets
+from motor_blog.text import markdown_widget_extension
+from motor_blog.web import fragment_cache, page_cache, post_index, view_counts
+from motor_blog.web.widgets import render_segments
 
 
 __all__ = (
@@ -20,26 +25,224 @@ __all__ = (
     'CategoryHandler', 'TagHandler', 'SearchHandler',
 )
 
-# TODO: cache-control headers
+# Cache-Control for each handler's cache_policy. Override some or all of
+# these with the cache_control option.
+CACHE_POLICIES = {
+    'list': {'max_age': 60, 's_maxage': 300, 'stale_while_revalidate': 60},
+    'post': {
+        'max_age': 300, 's_maxage': 3600, 'stale_while_revalidate': 300},
+    'feed': {
+        'max_age': 300, 's_maxage': 900, 'stale_while_revalidate': 300},
+    'search': {'max_age': 60},
+    'private': {'private': True},
+}
+
+
+def cache_control_header(policy):
+    """Format a dict like CACHE_POLICIES' values as a Cache-Control value."""
+    if policy.get('private'):
+        return 'private, no-cache'
+
+    directives = ['public']
+    for name in 'max_age', 's_maxage', 'stale_while_revalidate':
+        if policy.get(name) is not None:
+            directives.append('%s=%d' % (name.replace('_', '-'), policy[name]))
+
+    return ', '.join(directives)
+
+
+def page_cursor(pub_date, _id):
+    """Encode a post's position in listings, for 'before' or 'after' URLs."""
+    millis = (calendar.timegm(pub_date.utctimetuple()) * 1000
+              + pub_date.microsecond // 1000)
+
+    return '%d-%s' % (millis, _id)
+
+
+def parse_page_cursor(cursor):
+    """Decode page_cursor()'s output to a (pub_date, ObjectId) pair."""
+    try:
+        millis, _id = cursor.split('-')
+        pub_date = (datetime.datetime(1970, 1, 1) +
+                    datetime.timedelta(milliseconds=int(millis)))
+
+        return pub_date, ObjectId(_id)
+    except (ValueError, InvalidId, OverflowError):
+        raise tornado.web.HTTPError(400, 'Bad page cursor %r' % cursor)
 
 
 class MotorBlogHandler(tornado.web.RequestHandler):
+    # Subclasses showing public pages set this, to serve them from the
+    # page cache.
+    cacheable = False
+
+    # Request headers that change the rendered page.
+    page_cache_headers = ()
+
+    # Which of CACHE_POLICIES sets this handler's Cache-Control header.
+    cache_policy = 'private'
+
+    # Subclasses showing pages to visitors set this, to count their views
+    # if the count_page_views option is set.
+    counts_views = False
+
     def __init__(self, *args, **kwargs):
         super(MotorBlogHandler, self).__init__(*args, **kwargs)
         self._last_modified = None
+        self._surrogate_keys = set()
+
+        # Map Post ids to bodies with widgets rendered, see post_body().
+        self._post_bodies = {}
+        self._stale_page = None
+
+        # See page_cache.put().
+        self._page_cache_generation = None
+
+    def set_default_headers(self):
+        policy = self.settings['cache_control'].get(
+            self.cache_policy, CACHE_POLICIES[self.cache_policy])
+
+        self.set_header('Cache-Control', cache_control_header(policy))
+        if self.page_cache_headers:
+            # Tornado's gzip transform adds Accept-Encoding.
+            self.set_header('Vary', ', '.join(self.page_cache_headers))
+
+    def prepare(self):
+        self._page_cache_generation = page_cache.generation()
+        if self.cacheable and self.request.method in ('GET', 'HEAD'):
+            key = self.page_cache_key()
+            page = page_cache.get(key)
+            if page and page.stale_since is not None and self.is_refresh():
+                # Re-render the stale page. If rendering fails, the stale
+                # page is still cached until its grace period ends.
+                self._stale_page = page
+                page_cache.rendering.add(key)
+            elif page:
+                if page.stale_since is not None:
+                    self.refresh_stale_page(key)
+
+                # Tornado won't call get() since we finish here.
+                self.finish_cached_page(page)
+            else:
+                validator = page_cache.get_validator(key)
+                if validator and self.is_conditional():
+                    # Answer without rendering, if the client's copy is
+                    # current.
+                    self.set_validator_headers(validator)
+                    if self.is_not_modified():
+                        self.set_status(304)
+                        self.finish()
+                    else:
+                        self._last_modified = None
+                        self.clear_header('Last-Modified')
+                        self.clear_header('Etag')
+
+    def is_refresh(self):
+        """If this request was made by refresh_stale_page() or the warmer."""
+        return getattr(self.request, 'warmup', False)
+
+    def refresh_stale_page(self, key):
+        """Re-render a stale page in the background, unless already begun.
+        """
+        # The warmer imports this module.
+        from motor_blog.web import warmer
+
+        if key not in page_cache.rendering:
+            page_cache.rendering.add(key)
+            headers = dict(
+                (name, self.request.headers[name])
+                for name in self.page_cache_headers
+                if name in self.request.headers)
+
+            warmer.render(self.application, self.request.uri, headers)
+
+    def on_finish(self):
+        if self._stale_page:
+            key = self.page_cache_key()
+            page_cache.rendering.discard(key)
+            status = self.get_status()
+            if status not in (200, 304) and status < 500:
+                # Not found or moved: serving the stale page would show
+                # what's gone. Only server errors fall back to it.
+                page_cache.discard(key)
+
+        if (self.counts_views
+                and self.settings['count_page_views']
+                and self.request.method == 'GET'
+                and self.get_status() in (200, 304)
+                and not self.is_refresh()):
+            view_counts.count(self.request.path)
+
+    def write_error(self, status_code, **kwargs):
+        if self._stale_page and status_code >= 500:
+            self._last_modified = None
+            self.set_status(200)
+            self.finish_cached_page(self._stale_page)
+        else:
+            # Errors have no surrogate keys to purge them by, like a 404 for
+            # a post that's published later. Let proxies retry soon.
+            self.set_header('Cache-Control', 'no-cache')
 
-    def get_template_namespace(self):
-        ns = super(MotorBlogHandler, self).get_template_namespace()
+            super(MotorBlogHandler, self).write_error(status_code, **kwargs)
 
-        def get_setting(setting_name):
-            return self.application.settings[setting_name]
+    def page_cache_key(self):
+        return (self.request.uri,) + tuple(
+            self.request.headers.get(name)
+            for name in self.page_cache_headers)
 
-        # TODO: use ui_methods instead of this
-        ns.update({
-            'q': '',
-            'setting': get_setting,
-            'absolute': absolute})
+    def set_validator_headers(self, validator):
+        """Set Last-Modified, ETag and Surrogate-Key from a
+        page_cache.Validator.
+        """
+        self.update_last_mod(validator.last_modified)
+        self.set_last_modified_header()
+        self.set_header('Etag', validator.etag)
+        self.set_surrogate_key_header(validator.surrogate_keys)
+
+    def finish_cached_page(self, page):
+        self.set_validator_headers(page)
+        if self.is_not_modified():
+            self.set_status(304)
+            self.finish()
+        else:
+            encoding, body = page.variant(
+                self.request.headers.get('Accept-Encoding'))
+
+            if encoding:
+                # Tornado won't compress it again.
+                self.set_header('Content-Encoding', encoding)
+
+            if page.content_type:
+                self.set_header('Content-Type', page.content_type)
+
+            self.finish(body)
+
+    def add_surrogate_keys(self, *keys):
+        """Label this page for targeted eviction from the page cache.
+
+        See motor_blog.web.page_cache.
+        """
+        self._surrogate_keys.update(keys)
 
+    def add_post_keys(self, *posts):
+        """Label this page with the posts it shows. Ignores None."""
+        self.add_surrogate_keys(*[
+            page_cache.post_key(post.id) for post in posts if post])
+
+    def set_surrogate_key_header(self, keys=None):
+        """Name what's on this page, for purging it from a front proxy.
+
+        Defaults to the keys passed to add_surrogate_keys().
+        """
+        keys = self._surrogate_keys if keys is None else keys
+        self.set_header('Surrogate-Key', ' '.join(
+            sorted(keys) + [page_cache.ALL_KEY]))
+
+    def get_template_namespace(self):
+        ns = super(MotorBlogHandler, self).get_template_namespace()
+
+        # The search box's text. Functions like setting() are ui_methods.
+        ns['q'] = ''
         return ns
 
     def update_last_mod(self, thing):
@@ -82,37 +285,120 @@ class MotorBlogHandler(tornado.web.RequestHandler):
                 'Last-Modified',
                 self._last_modified.replace(microsecond=0))
 
+    def is_conditional(self):
+        return bool(self.request.headers.get('If-None-Match') or
+                    self.request.headers.get('If-Modified-Since'))
+
+    def is_not_modified(self):
+        """Compare If-None-Match to the ETag, if both are set, or else
+        If-Modified-Since to the Last-Modified date.
+        """
+        if (self.request.headers.get('If-None-Match')
+                and 'Etag' in self._headers):
+            return self.check_etag_header()
+
+        # Adapted from StaticFileHandler.
+        ims_value = self.request.headers.get("If-Modified-Since")
+        if ims_value is not None and self._last_modified:
+            date_tuple = email.utils.parsedate(ims_value)
+            if date_tuple is None:
+                # Malformed.
+                return False
+
+            if_since = models.utc_tz.localize(
+                datetime.datetime.fromtimestamp(time.mktime(date_tuple)))
+
+            return if_since >= self._last_modified.replace(microsecond=0)
+
+        return False
+
+    @gen.coroutine
+    def render_post_bodies(self, posts):
+        """Render widgets in posts' bodies, for post_body().
+
+        Posts without widgets, or None, are skipped. Posts saved before
+        Post.segments was added are split here.
+        """
+        posts_segments = []
+        for post in posts:
+            if not post:
+                continue
+
+            segments = post.segments
+            if not segments and '<widget>' in post.body:
+                segments = markdown_widget_extension.segments(post.body)
+
+            if segments:
+                posts_segments.append((post, segments))
+
+        posts = [post for post, _ in posts_segments]
+        results = yield [
+            render_segments(self, self.settings['db'], segments)
+            for _, segments in posts_segments]
+
+        for post, (html, modified) in zip(posts, results):
+            self._post_bodies[post.id] = html
+            if modified:
+                self.update_last_mod(modified)
+
+    def post_body(self, post):
+        """A post's HTML, with widgets if render_post_bodies() rendered them.
+        """
+        return self._post_bodies.get(post.id, post.body)
+
+    def render_fragment(self, template_name, post):
+        """Render a template showing one post, cached until the post changes.
+
+        Unpublished posts, and posts whose widgets were rendered for this
+        page, aren't cached.
+        """
+        if (not fragment_cache.enabled()
+                or post.status != 'publish'
+                or post.id in self._post_bodies):
+            return self.render_string(template_name, post=post)
+
+        key = fragment_cache.fragment_key(
+            template_name, post, self.settings['tz'])
+
+        html = fragment_cache.get(key)
+        if html is None:
+            html = self.render_string(template_name, post=post)
+            fragment_cache.put(key, html)
+
+        return html
+
     @gen.coroutine
     def render_async(self, template_name, **kwargs):
         """Like RequestHandler.render, with widgets.
 
-        Since widgets may need to do I/O, this must be async and its result
-        is yielded before the caller completes.
+        Widgets in the `post` or `posts` passed to the template are rendered
+        first. Since widgets may need to do I/O, this must be async and its
+        result is yielded before the caller completes.
         """
-        html = super(MotorBlogHandler, self).render_string(
-            template_name, **kwargs)
+        yield self.render_post_bodies(
+            list(kwargs.get('posts') or []) + [kwargs.get('post')])
 
-        rendered, modified = yield process_widgets(
-            self, self.settings['db'], html)
+        rendered = super(MotorBlogHandler, self).render_string(
+            template_name, **kwargs)
 
-        if modified:
-            self.update_last_mod(modified)
+        if self.cacheable and self.get_status() == 200:
+            page = page_cache.CachedPage(
+                rendered, self._last_modified, self._surrogate_keys)
 
-        self.set_last_modified_header()
+            page_cache.put(
+                self.page_cache_key(), page, self._page_cache_generation)
 
-        # Adapted from StaticFileHandler.
-        ims_value = self.request.headers.get("If-Modified-Since")
-        if ims_value is not None:
-            date_tuple = email.utils.parsedate(ims_value)
-            if_since = models.utc_tz.localize(
-                datetime.datetime.fromtimestamp(time.mktime(date_tuple)))
+            self.finish_cached_page(page)
+            return
 
-            if if_since >= self._last_modified.replace(microsecond=0):
-                # No change since client's last request. Tornado will take
-                # care of the rest.
-                self.set_status(304)
-                self.finish()
-                return
+        self.set_surrogate_key_header()
+        self.set_last_modified_header()
+        if self.is_not_modified():
+            # No change since client's last request. Tornado will take
+            # care of the rest.
+            self.set_status(304)
+            self.finish()
+            return
 
         self.finish(rendered)
 
@@ -137,18 +423,82 @@ class MotorBlogHandler(tornado.web.RequestHandler):
         categories = [Category(**doc) for doc in category_docs]
         raise gen.Return(categories)
 
+    @cache.memoized(
+        ['post_created', 'post_changed', 'post_deleted', 'categories_changed'],
+        max_entries=500,
+        key=lambda self, *args, **kwargs: cache.arguments_key(*args, **kwargs))
     @gen.coroutine
     def get_posts(self, query, fields, sort, skip, limit):
+        """Get a list of Posts.
+
+        `fields` is a projection or the name of one of Post.projections.
+        """
+        if isinstance(fields, basestring):
+            fields = Post.projection(fields)
+
         collection = self.settings['db'].posts
         cursor = collection.find(query, fields).sort(sort).skip(skip)
         docs = yield cursor.limit(limit).to_list(limit)
         posts = [Post(**doc) for doc in docs]
         raise gen.Return(posts)
 
+    @gen.coroutine
+    def get_page_of_posts(self, query, fields, list_url, page_num, page_size):
+        """Get a page of posts, newest first.
+
+        Pages are keyed on (pub_date, _id) with 'before' and 'after' query
+        arguments, so deep pages cost no more than the first. Old /page/N
+        URLs still work, using skip(). `list_url` is the first page's URL.
+
+        Returns the posts and the URLs of the pages of older and newer
+        posts, or None.
+        """
+        before = self.get_argument('before', None)
+        after = self.get_argument('after', None)
+        newest_first = [('pub_date', -1), ('_id', -1)]
+        if before or after:
+            pub_date, _id = parse_page_cursor(before or after)
+            op = '$lt' if before else '$gt'
+            query = dict(query, **{'$or': [
+                {'pub_date': {op: pub_date}},
+                {'pub_date': pub_date, '_id': {op: _id}}]})
+
+        if after:
+            # Get the posts just newer than the cursor, oldest first.
+            posts = yield self.get_posts(
+                query, fields, [('pub_date', 1), ('_id', 1)], 0, page_size + 1)
+
+            if len(posts) <= page_size:
+                # This is the first page.
+                self.redirect(list_url)
+                raise gen.Return((None, None, None))
+
+            posts = list(reversed(posts[:page_size]))
+            has_older = has_newer = True
+        else:
+            skip = 0 if before else page_num * page_size
+            posts = yield self.get_posts(
+                query, fields, newest_first, skip, page_size + 1)
+
+            has_older = len(posts) > page_size
+            has_newer = bool(before or page_num)
+            posts = posts[:page_size]
+
+        def url(name, post):
+            cursor = page_cursor(post.pub_date, post.id)
+            return '%s?%s' % (list_url, urllib.urlencode({name: cursor}))
+
+        older_url = url('before', posts[-1]) if has_older else None
+        if has_newer:
+            newer_url = url('after', posts[0]) if posts else list_url
+        else:
+            newer_url = None
+
+        raise gen.Return((posts, older_url, newer_url))
+
     def compute_etag(self):
-        # Don't waste time md5summing the output, we'll rely on the
-        # Last-Modified header
-        # TODO: what's the cost?
+        # Don't md5sum every response. Cacheable pages get an ETag once per
+        # render, from the page cache.
         return None
 
 
@@ -157,55 +507,88 @@ class RecentPostsHandler(MotorBlogHandler):
 
     This is the default home page.
     """
+    cacheable = True
+    counts_views = True
+    cache_policy = 'list'
+    page_size = 10
+    projection = 'list'
+
     @tornado.web.addslash
     @gen.coroutine
     def get(self, page_num=0):
-        posts = yield self.get_posts(
+        if self.settings['home_page']:
+            # The home page is static, recent posts start at /page/0.
+            list_url = self.reverse_url('page', 0)
+        else:
+            list_url = self.reverse_url('home')
+
+        posts, older_url, newer_url = yield self.get_page_of_posts(
             {'status': 'publish', 'type': 'post'},
-            {'original': False},
-            [('pub_date', -1)],
-            int(page_num) * 10,
-            10)
+            self.projection,
+            list_url,
+            int(page_num),
+            self.page_size)
+
+        if posts is None:
+            return
 
         categories = yield self.get_categories()
         self.update_last_mod_from_list(posts + categories)
+        self.add_surrogate_keys(page_cache.LIST_KEY)
+        self.add_post_keys(*posts)
         yield self.render_async(
             'recent-posts.jade',
             posts=posts,
             categories=categories,
-            page_num=int(page_num))
+            older_url=older_url,
+            newer_url=newer_url)
 
 
 class AllPostsHandler(MotorBlogHandler):
+    cacheable = True
+    counts_views = True
+    cache_policy = 'list'
+    page_size = 50
+    projection = 'summary'
+
     @tornado.web.addslash
     @gen.coroutine
     def get(self, page_num=0):
-        posts = yield self.get_posts(
+        posts, older_url, newer_url = yield self.get_page_of_posts(
             {'status': 'publish', 'type': 'post'},
-            {'original': False},
-            [('pub_date', -1)],
-            int(page_num) * 50,
-            50)
+            self.projection,
+            self.reverse_url('all-posts'),
+            int(page_num),
+            self.page_size)
+
+        if posts is None:
+            return
 
         categories = yield self.get_categories()
         self.update_last_mod_from_list(posts + categories)
+        self.add_surrogate_keys(page_cache.LIST_KEY)
+        self.add_post_keys(*posts)
         yield self.render_async(
             'all-posts.jade',
             posts=posts,
             categories=categories,
-            page_num=int(page_num))
+            older_url=older_url,
+            newer_url=newer_url)
 
 
 class PostHandler(MotorBlogHandler):
     """Show a single blog post or page, by slug."""
+    cacheable = True
+    counts_views = True
+    cache_policy = 'post'
+
     @tornado.web.addslash
     @gen.coroutine
     def get(self, slug):
         slug = slug.rstrip('/')
         posts = self.settings['db'].posts
         post_doc = yield posts.find_one(
-            {'slug': slug, 'status': 'publish'},
-            {'summary': False, 'original': False})
+            {'slug': slug, 'status': 'publish'}, Post.projection('full'))
 
         if not post_doc:
             raise tornado.web.HTTPError(404)
@@ -219,8 +602,15 @@ class PostHandler(MotorBlogHandler):
         post = Post(**post_doc)
 
         # Only posts have prev / next navigation, not pages.
+        nav = None
         if post.type == 'post':
-            fields = {'summary': False, 'body': False, 'original': False}
+            nav = post_index.neighbors(post.pub_date, post.id)
+
+        if nav:
+            prev_post, next_post = nav
+        elif post.type == 'post':
+            # The index isn't loaded, query MongoDB.
+            fields = Post.projection('nav')
             prev_doc_future = posts.find_one({
                 'status': 'publish', 'type': 'post',
                 'pub_date': {'$lt': post.pub_date}
@@ -235,16 +625,20 @@ class PostHandler(MotorBlogHandler):
             # querying for previous and next posts at once, and waiting for
             # both.
             prev_doc, next_doc = yield [prev_doc_future, next_doc_future]
+            prev_post = Post(**prev_doc) if prev_doc else None
+            next_post = Post(**next_doc) if next_doc else None
         else:
-            prev_doc, next_doc = None, None
+            prev_post, next_post = None, None
 
-        prev_post = Post(**prev_doc) if prev_doc else None
-        next_post = Post(**next_doc) if next_doc else None
         categories = yield self.get_categories()
         self.update_last_mod(post)
         self.update_last_mod(prev_post)
         self.update_last_mod(next_post)
         self.update_last_mod_from_list(categories)
+        self.add_post_keys(post, prev_post, next_post)
+        if post.type == 'post':
+            self.add_surrogate_keys(page_cache.NAV_KEY)
+
         yield self.render_async(
             'single.jade',
             post=post,
@@ -274,6 +668,12 @@ class HomeHandler(PostHandler):
 
 class CategoryHandler(MotorBlogHandler):
     """Page of posts for a category"""
+    cacheable = True
+    counts_views = True
+    cache_policy = 'list'
+    page_size = 10
+    projection = 'list'
+
     @tornado.web.addslash
     @gen.coroutine
     def get(self, slug, page_num=0):
@@ -285,45 +685,63 @@ class CategoryHandler(MotorBlogHandler):
         else:
             raise tornado.web.HTTPError(404)
 
-        slug = slug.rstrip('/')
-        posts = yield self.get_posts(
+        posts, older_url, newer_url = yield self.get_page_of_posts(
             {'status': 'publish', 'type': 'post', 'categories.slug': slug},
-            {'original': False},
-            [('pub_date', -1)],
-            int(page_num) * 10,
-            10)
+            self.projection,
+            self.reverse_url('category', slug),
+            int(page_num),
+            self.page_size)
+
+        if posts is None:
+            return
 
         self.update_last_mod_from_list(posts + categories)
+        self.add_surrogate_keys(page_cache.category_key(slug))
+        self.add_post_keys(*posts)
         yield self.render_async(
             'category.jade',
             posts=posts,
             categories=categories,
             this_category=this_category,
-            page_num=int(page_num))
+            older_url=older_url,
+            newer_url=newer_url)
 
 
 class TagHandler(MotorBlogHandler):
     """Page of posts for a tag"""
+    cacheable = True
+    counts_views = True
+    cache_policy = 'list'
+    page_size = 10
+    projection = 'list'
+
     @tornado.web.addslash
     @gen.coroutine
     def get(self, tag, page_num=0):
         tag = tag.rstrip('/')
-        posts = yield self.get_posts(
+        posts, older_url, newer_url = yield self.get_page_of_posts(
             {'status': 'publish', 'type': 'post', 'tags': tag},
-            {'original': False},
-            [('pub_date', -1)],
-            int(page_num) * 10,
-            10)
+            self.projection,
+            self.reverse_url('tag', tag),
+            int(page_num),
+            self.page_size)
+
+        if posts is None:
+            return
 
         categories = yield self.get_categories()
         self.update_last_mod_from_list(posts + categories)
+        self.add_surrogate_keys(page_cache.tag_key(tag))
+        self.add_post_keys(*posts)
         yield self.render_async(
             'tag.jade',
             posts=posts, categories=categories,
-            this_tag=tag, page_num=int(page_num))
+            this_tag=tag, older_url=older_url, newer_url=newer_url)
 
 
 class SearchHandler(MotorBlogHandler):
+    cache_policy = 'search'
+
     @gen.coroutine
     def get(self):
         categories = yield self.get_categories()
@@ -332,7 +750,7 @@ class SearchHandler(MotorBlogHandler):
             score = {'$meta': 'textScore'}
             posts = yield self.get_posts(
                 {'$text': {'$search': q}, 'status': 'publish', 'type': 'post'},
-                fields={'original': 0, 'plain': 0, 'score': score},
+                fields=dict(Post.projection('summary'), score=score),
                 sort=[('score', score)],
                 skip=0,
                 limit=50)
@@ -1,20 +1,41 @@
-"""Analytics for Motor-Blog."""
+"""Analytics for Motor-Blog.
+
+Feed entries include a tracking pixel, and each pixel served is reported to
+Google Analytics as an event. Reports aren't sent while serving the pixel:
+they're pushed onto a bounded queue, and a background sender POSTs them to
+the Measurement Protocol's batch endpoint, up to 20 at a time, one batch at
+a time. When a post is popular and the collector can't keep up, the queue
+fills and further hits are dropped and counted, rather than piling up
+requests on the IOLoop. The sender's counts of hits sent, dropped and
+failed are logged every `stats_interval` seconds, and when it stops.
+"""
 
 import logging
 import os
 import urllib
+import urlparse
 import uuid
 
 # https://github.com/mirumee/google-measurement-protocol
 import google_measurement_protocol as gmp
 from tornado import gen
-from tornado.httpclient import AsyncHTTPClient
+from tornado.escape import utf8
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.queues import Queue, QueueFull
 import tornado.web
 from motor_blog.text.link import absolute
+from motor_blog.web import post_index, view_counts
 
 
-__all__ = ['TrackingPixelHandler']
+__all__ = ['TrackingPixelHandler', 'AnalyticsSender', 'start', 'stop']
 
+BATCH_URI = 'https://www.google-analytics.com/batch'
+
+# The Measurement Protocol's limits.
+MAX_BATCH_HITS = 20
+MAX_BATCH_BYTES = 16 * 1024
+MAX_HIT_BYTES = 8 * 1024
 
 # Contents of a 1-pixel clear gif, served to client as tracking pixel
 gif = open(os.path.normpath(
@@ -22,14 +43,164 @@ gif = open(os.path.normpath(
 
 cookie_name = 'motor-blog-analytics-client-id'
 
+# This process's AnalyticsSender, see start().
+_sender = None
+
+# The PeriodicCallback that logs its stats.
+_stats_logger = None
+
+
+class AnalyticsSender(object):
+    """Queue hits and send them in batches.
+
+    Counts hits `sent`, `dropped` because the queue was full or they were too
+    large, and `failed` because the collector didn't accept them.
+    """
+    def __init__(
+            self, uri=BATCH_URI, max_queue=10000, max_batch=MAX_BATCH_HITS,
+            retries=2, backoff=1):
+        self.uri = uri
+        self.queue = Queue(maxsize=max_queue)
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self.sent = self.dropped = self.failed = 0
+        self.running = False
+
+        # A hit that didn't fit in the previous batch.
+        self._held = None
+
+    def track(self, data):
+        """Queue a hit, a dict of Measurement Protocol parameters."""
+        hit = urllib.urlencode(
+            [(name, utf8(value)) for name, value in sorted(data.items())])
+
+        if len(hit) > MAX_HIT_BYTES:
+            self.drop('Analytics hit too large')
+            return
+
+        try:
+            self.queue.put_nowait(hit)
+        except QueueFull:
+            self.drop('Analytics queue full')
+
+    def drop(self, reason):
+        self.dropped += 1
+        if self.dropped % 1000 == 1:
+            logging.warning('%s, %d hits dropped so far', reason, self.dropped)
+
+    @gen.coroutine
+    def next_batch(self):
+        """Wait for a hit, and take as many more as fit in one batch.
+
+        Returns an empty batch if woken by stop().
+        """
+        if self._held is None:
+            hit = yield self.queue.get()
+            if hit is None:
+                raise gen.Return([])
+
+            hits = [hit]
+        else:
+            hits, self._held = [self._held], None
+
+        size = len(hits[0])
+        while len(hits) < self.max_batch and self.queue.qsize():
+            hit = self.queue.get_nowait()
+            if hit is None:
+                # Stopped.
+                break
+
+            # Count a newline between hits.
+            if size + 1 + len(hit) > MAX_BATCH_BYTES:
+                self._held = hit
+                break
+
+            hits.append(hit)
+            size += 1 + len(hit)
+
+        raise gen.Return(hits)
+
+    @gen.coroutine
+    def send(self, hits):
+        request = HTTPRequest(self.uri, method='POST', body='\n'.join(hits))
+        for attempt in range(self.retries + 1):
+            try:
+                yield AsyncHTTPClient().fetch(request)
+                self.sent += len(hits)
+                return
+            except Exception as exc:
+                if attempt == self.retries:
+                    logging.error(
+                        'Giving up sending %d analytics hits: %s',
+                        len(hits), exc)
+
+                    self.failed += len(hits)
+                else:
+                    yield gen.sleep(self.backoff * 2 ** attempt)
+
+    @gen.coroutine
+    def run(self):
+        """Send batches until stop()."""
+        self.running = True
+        while self.running:
+            hits = yield self.next_batch()
+            if hits:
+                yield self.send(hits)
+
+    def stop(self):
+        """Make run() return, after sending the batch it's sending now."""
+        self.running = False
+        try:
+            # Wake run() if it's waiting for a hit. If the queue is full,
+            # it isn't.
+            self.queue.put_nowait(None)
+        except QueueFull:
+            pass
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize() + (self._held is not None),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed}
+
+    def log_stats(self):
+        logging.info(
+            'Analytics hits: %(queued)d queued, %(sent)d sent,'
+            ' %(dropped)d dropped, %(failed)d failed', self.stats())
+
+
+def start(uri=BATCH_URI, max_queue=10000, stats_interval=600):
+    """Send this process's tracked hits in the background.
+
+    Returns the AnalyticsSender.
+    """
+    global _sender, _stats_logger
+    _sender = AnalyticsSender(uri, max_queue)
+    IOLoop.current().spawn_callback(_sender.run)
+    _stats_logger = PeriodicCallback(_sender.log_stats, stats_interval * 1000)
+    _stats_logger.start()
+    return _sender
+
+
+def stop():
+    """Stop tracking hits. Hits already queued may not be sent."""
+    global _sender, _stats_logger
+    if _sender:
+        _stats_logger.stop()
+        _sender.log_stats()
+        _sender.stop()
+        _sender = _stats_logger = None
+
 
 class TrackingPixelHandler(tornado.web.RequestHandler):
-    """Serve a pixel, and asynchronously report event to Google Analytics.
+    """Serve a pixel, count a view, and queue an event for Google Analytics.
 
     `path` is the page or post being viewed. It is used as the 'label'
-    parameter to the event in the Google Measurement API.
+    parameter to the event in the Google Measurement API. Views are counted
+    only for published posts' URLs, once the post index is loaded.
     """
-    @gen.coroutine
     def get(self, path):
         self.set_header('Content-Type', 'image/gif')
         analytics_client_id = self.get_cookie(cookie_name) or str(uuid.uuid4())
@@ -37,24 +208,25 @@ class TrackingPixelHandler(tornado.web.RequestHandler):
         self.write(gif)
         self.finish()
 
-        http_client = AsyncHTTPClient()
+        # Count the view by the post's path, like the web page's views.
+        post_path = urlparse.urlsplit(path).path
+        slug = post_path.rstrip('/').rsplit('/', 1)[-1]
+        if (post_index.published(slug)
+                and self.reverse_url('post', slug) == post_path):
+            view_counts.count(post_path)
+
+        if not _sender:
+            return
+
         event = gmp.Event(category='RSS', action='view-post', label=path)
 
-        for data, headers in gmp.payloads(
+        # payloads() returns the extra_headers we pass, none. Hits in a
+        # batch share one request's headers anyway.
+        for data, _ in gmp.payloads(
                 tracking_id=self.settings['google_analytics_rss_id'],
                 client_id=analytics_client_id,
                 requestable=event):
-
-            try:
-                yield http_client.fetch(
-                    gmp.TRACKING_URI,
-                    method='POST',
-                    headers=headers,
-                    body=urllib.urlencode(data))
-
-                logging.info('Tracked RSS view for "%s"' % path)
-            except Exception:
-                logging.exception('Error tracking RSS view for "%s".' % path)
+            _sender.track(data)
 
 
 def ga_track_event_url(application, path):
@@ -0,0 +1,374 @@
+"""In-memory cache of fully rendered pages.
+
+MotorBlogHandler subclasses with `cacheable = True` store the final body of
+each page here, keyed by URL, and serve later requests from it without
+querying MongoDB or rendering templates.
+
+Each page is labeled with "surrogate keys" naming what it shows: the posts
+on it, and the list it belongs to. When an event describes a changed post,
+only pages with matching keys are evicted. Pages are also evicted when the
+cache outgrows its memory limit.
+
+Optionally, evicted pages are kept for a grace period, marked stale.
+Readers are served the stale copy at once, while the first of them starts
+re-rendering the page in the background. If rendering fails the stale copy
+is still served, until the grace period ends.
+
+Pages are compressed once, when cached, with gzip and, if the brotli
+module is installed, with brotli. Requests are served the variant their
+Accept-Encoding allows. If caching pages is disabled they aren't
+compressed here; Tornado compresses responses as usual.
+
+Each page's Last-Modified date and ETag are also kept, in a separate cache
+limited by number of pages rather than bytes, and evicted by events the
+same way. Conditional GETs for pages whose bodies have been evicted for
+lack of memory are answered from them without rendering.
+"""
+
+import gzip
+import hashlib
+import time
+import urllib
+from cStringIO import StringIO
+
+from tornado.escape import utf8
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from motor_blog import cache
+
+__all__ = (
+    'CachedPage', 'Validator', 'configure', 'enabled', 'get', 'get_validator',
+    'put', 'discard', 'generation', 'evictions', 'invalidate', 'evict',
+    'rendering',
+    'post_key', 'category_key', 'tag_key', 'LIST_KEY', 'NAV_KEY', 'ALL_KEY',
+    'POPULAR_KEY',
+    'surrogate_keys_for_event',
+)
+
+# Pages listing all recent posts, like the home page.
+LIST_KEY = 'list'
+
+# Single-post pages, which link to the previous and next posts.
+NAV_KEY = 'nav'
+
+# Pages showing the most-viewed posts, see rankings.
+POPULAR_KEY = 'popular'
+
+# Sent in every page's Surrogate-Key header, so a front proxy can purge all.
+ALL_KEY = 'all'
+
+# Like Tornado's GZipContentEncoding: shorter pages aren't worth compressing.
+MIN_COMPRESS_LENGTH = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+
+
+def post_key(post_id):
+    return 'post/%s' % post_id
+
+
+def category_key(slug):
+    return 'category/%s' % slug
+
+
+def tag_key(tag):
+    # Tags may contain spaces.
+    return 'tag/%s' % urllib.quote(tag.encode('utf-8'), safe='')
+
+
+class Validator(object):
+    """A page's Last-Modified date and ETag, without its body."""
+    def __init__(self, last_modified, etag, surrogate_keys=()):
+        self.last_modified = last_modified
+        self.etag = etag
+        self.surrogate_keys = frozenset(surrogate_keys)
+
+
+class CachedPage(Validator):
+    """A rendered page and the headers needed to serve it again.
+
+    `content_type` is None for Tornado's default, HTML.
+    """
+    def __init__(
+            self, body, last_modified, surrogate_keys=(), content_type=None):
+        body = utf8(body)
+
+        # Weak, since compressed variants share it.
+        etag = 'W/"%s"' % hashlib.md5(body).hexdigest()
+        super(CachedPage, self).__init__(last_modified, etag, surrogate_keys)
+        self.body = body
+        self.content_type = content_type
+
+        # Map content-codings like 'gzip' to compressed bodies, see
+        # compress().
+        self.encoded = {}
+
+        # When the page was invalidated, if it's kept while stale.
+        self.stale_since = None
+
+    def compress(self):
+        """Make the compressed variants, if the body is long enough."""
+        if len(self.body) >= MIN_COMPRESS_LENGTH and not self.encoded:
+            self.encoded['gzip'] = _gzip(self.body)
+            if brotli:
+                self.encoded['br'] = brotli.compress(
+                    self.body, quality=BROTLI_QUALITY)
+
+    @property
+    def size(self):
+        return len(self.body) + sum(map(len, self.encoded.values()))
+
+    def variant(self, accept_encoding):
+        """Choose a body for an Accept-Encoding header.
+
+        Returns a content-coding, or None for the uncompressed body, and the
+        body.
+        """
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in 'br', 'gzip':
+            if encoding in accepted and encoding in self.encoded:
+                return encoding, self.encoded[encoding]
+
+        return None, self.body
+
+
+def _gzip(data):
+    buf = StringIO()
+    with gzip.GzipFile(
+            mode='wb', fileobj=buf, compresslevel=GZIP_LEVEL,
+            mtime=0) as gzip_file:
+        gzip_file.write(data)
+
+    return buf.getvalue()
+
+
+def _accepted_encodings(accept_encoding):
+    """Content-codings in an Accept-Encoding header, except with q=0."""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        try:
+            if float(params.replace(' ', '').partition('q=')[2]) == 0:
+                continue
+        except ValueError:
+            # No q-value.
+            pass
+
+        accepted.add(coding.strip().lower())
+
+    return accepted
+
+
+def _evicted(page_key, page):
+    if page_key in _pages or page_key in _validators:
+        # Still indexed for the other cache.
+        return
+
+    _unindex(page_key, page.surrogate_keys)
+
+
+def _unindex(page_key, surrogate_keys):
+    for surrogate_key in surrogate_keys:
+        page_keys = _page_keys.get(surrogate_key)
+        if page_keys:
+            page_keys.discard(page_key)
+            if not page_keys:
+                del _page_keys[surrogate_key]
+
+
+_pages = cache.LRUCache(
+    max_bytes=64 * 1024 * 1024,
+    sizeof=lambda page: page.size,
+    on_evict=_evicted)
+
+_validators = cache.LRUCache(max_entries=10000, on_evict=_evicted)
+
+# Map surrogate keys to sets of keys in _pages or _validators.
+_page_keys = {}
+
+# Seconds to keep invalidated pages, see configure().
+_stale_grace = 0
+
+# Keys of stale pages being re-rendered now.
+rendering = set()
+
+# Incremented by each invalidation, see put().
+_generation = 0
+
+# Number of pages invalidations have evicted or marked stale.
+_evictions = 0
+
+
+def configure(max_bytes, stale_grace=0):
+    """Set the memory limit. Zero disables caching pages, though their
+    Validators are still kept.
+
+    If `stale_grace` is positive, invalidated pages are marked stale and
+    may be served for that many seconds while they're re-rendered.
+    """
+    global _stale_grace
+    _stale_grace = stale_grace
+    _pages.max_bytes = max_bytes
+    _pages.trim()
+
+
+def enabled():
+    return _pages.max_bytes > 0
+
+
+def get(key):
+    """A CachedPage, or None. Check the page's `stale_since`."""
+    page = _pages.get(key)
+    if page and page.stale_since is not None:
+        if time.time() > page.stale_since + _stale_grace:
+            _pages.pop(key)
+            return None
+
+    return page
+
+
+def get_validator(key):
+    """A Validator for a page that's unchanged since it was put(), or None."""
+    return _validators.get(key)
+
+
+def generation():
+    """The current generation, to pass to put() after rendering a page."""
+    return _generation
+
+
+def evictions():
+    """How many pages invalidations have evicted, e.g. to know if any were.
+    """
+    return _evictions
+
+
+def put(key, page, generation=None):
+    """Cache a page and its Validator.
+
+    If `generation` is given and pages have been invalidated since, the page
+    may have been rendered from outdated data, and isn't cached.
+    """
+    if generation is not None and generation != _generation:
+        return
+
+    # A page put again may not have its old version's surrogate keys.
+    old_surrogate_keys = set()
+    for old in _pages.peek(key), _validators.peek(key):
+        if old:
+            old_surrogate_keys.update(old.surrogate_keys)
+
+    if enabled():
+        # Only pages that are kept are worth compressing.
+        page.compress()
+        _pages.set(key, page)
+
+    _validators.set(
+        key, Validator(page.last_modified, page.etag, page.surrogate_keys))
+
+    _unindex(key, old_surrogate_keys.difference(page.surrogate_keys))
+
+    for surrogate_key in page.surrogate_keys:
+        _page_keys.setdefault(surrogate_key, set()).add(key)
+
+
+def discard(key):
+    """Forget a page, e.g. because it's gone, even if it's stale."""
+    _validators.pop(key)
+    _pages.pop(key)
+
+
+def invalidate(event=None):
+    """Evict pages affected by an event, or all pages."""
+    global _generation, _evictions
+    surrogate_keys = surrogate_keys_for_event(event) if event else None
+    if surrogate_keys is None:
+        _generation += 1
+        _evictions += len(_validators)
+        if _stale_grace:
+            for page_key in _validators.keys():
+                _validators.pop(page_key)
+
+            for page in _pages.values():
+                _mark_stale(page)
+        else:
+            _pages.clear()
+            _validators.clear()
+            _page_keys.clear()
+    else:
+        evict(surrogate_keys)
+
+
+def evict(surrogate_keys):
+    """Evict pages labeled with any of `surrogate_keys`."""
+    global _generation, _evictions
+    _generation += 1
+    for surrogate_key in surrogate_keys:
+        for page_key in list(_page_keys.get(surrogate_key, ())):
+            _evictions += 1
+            _validators.pop(page_key)
+            if _stale_grace and page_key in _pages:
+                _mark_stale(_pages.peek(page_key))
+            else:
+                _pages.pop(page_key)
+
+
+def _mark_stale(page):
+    if page.stale_since is None:
+        page.stale_since = time.time()
+
+
+def surrogate_keys_for_event(event):
+    """Keys of pages affected by an event, or None for all pages."""
+    if 'posts' not in event:
+        # E.g., categories_changed: every page shows the category list.
+        return None
+
+    surrogate_keys = set()
+    for info in event['posts']:
+        surrogate_keys.update(_surrogate_keys_for_post(info))
+
+    return surrogate_keys
+
+
+def _surrogate_keys_for_post(info):
+    """Keys of pages affected by one post's change.
+
+    'info' is a dict from models.post_event_info().
+    """
+    was_public = info['old_status'] == 'publish'
+    is_public = info['status'] == 'publish'
+    if not was_public and not is_public:
+        # A draft.
+        return []
+
+    keys = [post_key(info['id'])]
+    if info['type'] != 'post':
+        # Pages aren't listed anywhere.
+        return keys
+
+    tags = set(info['tags']), set(info['old_tags'])
+    categories = set(info['categories']), set(info['old_categories'])
+    if was_public != is_public or info['pub_date'] != info['old_pub_date']:
+        # The post enters, leaves, or moves within every list it's on.
+        keys += [LIST_KEY, NAV_KEY]
+        changed_tags = tags[0] | tags[1]
+        changed_categories = categories[0] | categories[1]
+    else:
+        # Pages already showing the post are found by its post_key, above.
+        changed_tags = tags[0] ^ tags[1]
+        changed_categories = categories[0] ^ categories[1]
+
+    keys += [tag_key(tag) for tag in changed_tags]
+    keys += [category_key(slug) for slug in changed_categories]
+    return keys
+
+
+for _event_name in (
+        'post_created', 'post_changed', 'post_deleted', 'categories_changed',
+        cache.FLUSH_EVENT):
+    cache.on(_event_name, invalidate)
@@ -0,0 +1,185 @@
+"""In-memory index of published posts, ordered by pub_date.
+
+Answers which posts come before and after a post, lists the newest posts,
+and tells whether a slug is published, without querying MongoDB. load()
+builds the index at startup, and it's updated from the posts described in
+post events. Events that don't describe posts make it reload.
+
+Until the index is loaded, its functions return None, and callers query
+MongoDB instead.
+"""
+
+import bisect
+import logging
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from motor_blog import cache
+from motor_blog.models import Post, utc_tz
+
+__all__ = ('load', 'unload', 'neighbors', 'newest', 'published')
+
+_db = None
+_ready = False
+_loading = False
+_load_again = False
+
+# (pub_date, _id) pairs of published posts, oldest first, and parallel lists
+# of their slugs, titles, and modification dates.
+_keys = []
+_slugs = []
+_titles = []
+_mods = []
+
+# Map _id to pub_date, to find a post's position.
+_pub_dates = {}
+
+# Slugs of published posts.
+_published = set()
+
+
+@gen.coroutine
+def load(db):
+    """Query all published posts and rebuild the index."""
+    global _db, _ready, _loading, _load_again
+    _db = db
+    if _loading:
+        # Load once more when the current load is done.
+        _load_again = True
+        return
+
+    _loading = True
+    _ready = False
+    try:
+        while True:
+            _load_again = False
+            docs = yield db.posts.find(
+                {'status': 'publish', 'type': 'post'},
+                Post.projection('nav'),
+                sort=[('pub_date', 1), ('_id', 1)]).to_list(None)
+
+            if not _load_again:
+                break
+
+        _clear()
+        for doc in docs:
+            _insert(
+                doc['_id'], doc['pub_date'], doc['slug'], doc['title'],
+                doc['mod'])
+
+        _ready = True
+    except Exception:
+        logging.exception('Loading post index')
+    finally:
+        _loading = False
+
+
+def unload():
+    """Forget the index, and stop following events."""
+    global _db, _ready
+    _db = None
+    _ready = False
+    _clear()
+
+
+def neighbors(pub_date, _id):
+    """The published posts before and after a post, or None if not loaded.
+
+    Returns a pair of Posts with 'nav' fields, either of which may be None.
+    """
+    if not _ready:
+        return None
+
+    key = (_utc(pub_date), _id)
+    before = bisect.bisect_left(_keys, key) - 1
+    after = bisect.bisect_right(_keys, key)
+    return (
+        _post(before) if before >= 0 else None,
+        _post(after) if after < len(_keys) else None)
+
+
+def newest(skip, limit):
+    """Published posts, newest first, with 'nav' fields, or None."""
+    if not _ready:
+        return None
+
+    stop = len(_keys) - skip
+    start = max(stop - limit, 0)
+    return [_post(i) for i in range(stop - 1, start - 1, -1)]
+
+
+def published(slug):
+    """Whether a published post has this slug, or None if not loaded."""
+    if not _ready:
+        return None
+
+    return slug in _published
+
+
+def _post(i):
+    pub_date, _id = _keys[i]
+    return Post(
+        id=_id, type='post', status='publish', pub_date=pub_date,
+        slug=_slugs[i], title=_titles[i], mod=_mods[i])
+
+
+def _utc(dt):
+    # Naive UTC, like datetimes from MongoDB.
+    if dt and dt.tzinfo:
+        return dt.astimezone(utc_tz).replace(tzinfo=None)
+
+    return dt
+
+
+def _clear():
+    for array in (_keys, _slugs, _titles, _mods):
+        del array[:]
+
+    _pub_dates.clear()
+    _published.clear()
+
+
+def _insert(_id, pub_date, slug, title, mod):
+    key = (_utc(pub_date), _id)
+    i = bisect.bisect_left(_keys, key)
+    _keys.insert(i, key)
+    _slugs.insert(i, slug)
+    _titles.insert(i, title)
+    _mods.insert(i, _utc(mod))
+    _pub_dates[_id] = key[0]
+    _published.add(slug)
+
+
+def _remove(_id):
+    if _id not in _pub_dates:
+        return
+
+    i = bisect.bisect_left(_keys, (_pub_dates.pop(_id), _id))
+    _published.discard(_slugs[i])
+    for array in (_keys, _slugs, _titles, _mods):
+        del array[i]
+
+
+def _on_event(event):
+    global _load_again
+    if not _db:
+        # Not loaded.
+        return
+
+    if 'posts' not in event:
+        IOLoop.current().add_callback(load, _db)
+    elif _loading:
+        _load_again = True
+    elif _ready:
+        for info in event['posts']:
+            _remove(info['id'])
+            if info['type'] == 'post' and info['status'] == 'publish':
+                _insert(
+                    info['id'], info['pub_date'], info['slug'],
+                    info['title'], info['mod'])
+
+
+for _event_name in (
+        'post_created', 'post_changed', 'post_deleted', cache.FLUSH_EVENT):
+    cache.on(_event_name, _on_event)
@@ -0,0 +1,179 @@
+"""Purge changed pages from front proxies like Varnish, nginx, or a CDN.
+
+A Purger listens for post and category events and sends HTTP requests to
+each configured proxy endpoint. Events arriving within `delay` seconds are
+batched. By default it sends one request per endpoint naming the affected
+pages' surrogate keys in a Surrogate-Key header, matching the header
+MotorBlogHandler sends with each page. With `by_url`, it sends one request
+per affected URL instead, for proxies that can't purge by key; pages that
+link to a post from elsewhere, like its neighbors, aren't purged then.
+
+Events that affect every page, like a flush or a category change, can't be
+purged page by page. With `by_url`, only the warmer's hot URLs are purged
+then: the home page and feed, the first pages of recent posts, each
+category's page and feed, and the most-used tags' pages. Proxies serve
+other pages until they expire, so with `by_url` keep proxies' TTLs short,
+or ban all pages by other means after such events.
+
+Requests that fail with a connection error or a server error are retried
+with exponential backoff. Proxies answer 404, or 412 for some nginx
+purge modules, when the page isn't cached; that's a success. Other errors
+aren't retried.
+"""
+
+import logging
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
+from tornado.ioloop import IOLoop
+
+from motor_blog import cache
+from motor_blog.web import page_cache, warmer
+from motor_blog.web.feed import FORMATS, feed_url_name
+
+__all__ = ('Purger', 'start')
+
+PURGE_EVENTS = (
+    'post_created', 'post_changed', 'post_deleted', 'categories_changed',
+    cache.FLUSH_EVENT)
+
+# Responses meaning there was nothing to purge.
+NOT_CACHED_CODES = (404, 412)
+
+
+class Purger(object):
+    def __init__(
+            self, application, endpoints, by_url=False, method='PURGE',
+            delay=1, retries=3, backoff=1):
+        self.application = application
+        self.endpoints = [endpoint.rstrip('/') for endpoint in endpoints]
+        self.by_url = by_url
+        self.method = method
+        self.delay = delay
+        self.retries = retries
+        self.backoff = backoff
+
+        # Surrogate keys or URLs to purge in the next batch.
+        self.pending = set()
+        self.pending_all = False
+        self.timeout = None
+
+    def on_event(self, event):
+        keys = page_cache.surrogate_keys_for_event(event)
+        if keys is None:
+            self.pending_all = True
+        elif self.by_url:
+            self.pending.update(self.urls(event, keys))
+        else:
+            self.pending.update(keys)
+
+        if self.timeout is None and (self.pending or self.pending_all):
+            self.timeout = IOLoop.current().call_later(
+                self.delay, self.flush)
+
+    def urls(self, event, keys):
+        """Paths of the pages with surrogate `keys`, for a post event."""
+        reverse_url = self.application.reverse_url
+        urls = set()
+        if page_cache.LIST_KEY in keys:
+            urls.update([reverse_url('home'), reverse_url('all-posts')])
+            urls.update(
+                reverse_url(feed_url_name(None, format))
+                for format in FORMATS)
+
+        for info in event['posts']:
+            if page_cache.post_key(info['id']) in keys:
+                urls.update(
+                    reverse_url('post', slug)
+                    for slug in (info['slug'], info['old_slug']) if slug)
+
+            for tag in set(info['tags'] + info['old_tags']):
+                if page_cache.tag_key(tag) in keys:
+                    urls.add(reverse_url('tag', tag))
+                    urls.update(
+                        reverse_url(feed_url_name('tag', format), tag)
+                        for format in FORMATS)
+
+            for slug in set(info['categories'] + info['old_categories']):
+                if page_cache.category_key(slug) in keys:
+                    urls.add(reverse_url('category', slug))
+                    urls.update(
+                        reverse_url(feed_url_name('category', format), slug)
+                        for format in FORMATS)
+
+        return urls
+
+    @gen.coroutine
+    def flush(self):
+        """Send a batch of purge requests to all endpoints."""
+        pending, pending_all = self.pending, self.pending_all
+        self.pending, self.pending_all = set(), False
+        self.timeout = None
+        if not pending and not pending_all:
+            return
+
+        if self.by_url:
+            if pending_all:
+                settings = self.application.settings
+                hot_uris = yield warmer.hot_uris(
+                    self.application,
+                    settings['warm_pages'],
+                    settings['warm_tags'])
+
+                pending.update(hot_uris)
+
+            requests = [
+                HTTPRequest(
+                    endpoint + url,
+                    method=self.method,
+                    headers={'Host': self.application.settings['host']},
+                    allow_nonstandard_methods=True)
+                for endpoint in self.endpoints for url in sorted(pending)]
+        else:
+            if pending_all:
+                pending = set([page_cache.ALL_KEY])
+
+            requests = [
+                HTTPRequest(
+                    endpoint + '/',
+                    method=self.method,
+                    headers={'Surrogate-Key': ' '.join(sorted(pending))},
+                    allow_nonstandard_methods=True)
+                for endpoint in self.endpoints]
+
+        yield [self.send(request) for request in requests]
+
+    @gen.coroutine
+    def send(self, request):
+        for attempt in range(self.retries + 1):
+            try:
+                yield AsyncHTTPClient().fetch(request)
+                return
+            except Exception as exc:
+                # Tornado reports connection errors as HTTPError 599.
+                if isinstance(exc, HTTPError) and exc.code < 500:
+                    if exc.code not in NOT_CACHED_CODES:
+                        logging.error(
+                            '%s %s: %s', request.method, request.url, exc)
+
+                    return
+
+                if attempt == self.retries:
+                    logging.error(
+                        'Giving up %s %s: %s', request.method, request.url,
+                        exc)
+                else:
+                    logging.warning(
+                        '%s %s: %s, retrying', request.method, request.url,
+                        exc)
+
+                    yield gen.sleep(self.backoff * 2 ** attempt)
+
+
+def start(application, endpoints, by_url=False, method='PURGE', delay=1):
+    """Purge proxies after each event. Returns the Purger."""
+    purger = Purger(application, endpoints, by_url, method, delay)
+    for event_name in PURGE_EVENTS:
+        cache.on(event_name, purger.on_event)
+
+    return purger
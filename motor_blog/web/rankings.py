@@ -0,0 +1,157 @@
+"""Rank posts by views, for the popular-posts widget.
+
+Summing each post's views over a window of days is an aggregation of the
+views collection, too slow to run for every page. Rankings are recomputed in
+the background every `interval` seconds, and when posts change, and kept in
+memory, so the widget only looks them up.
+
+Widgets register the windows they show: the first time a window is asked
+for, popular() returns None and the window is ranked soon after. When any
+ranking changes, generation() changes and pages showing popular posts are
+evicted from the page cache.
+"""
+
+import datetime
+import logging
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from motor_blog import cache
+from motor_blog.models import Post
+from motor_blog.web import page_cache, view_counts
+
+__all__ = ('start', 'stop', 'popular', 'generation', 'refresh', 'rank')
+
+# Events after which ranked posts may have changed or been unpublished.
+RANK_EVENTS = (
+    'post_created', 'post_changed', 'post_deleted', cache.FLUSH_EVENT)
+
+# Most posts kept for each window.
+MAX_RANKED = 50
+
+_application = None
+_periodic = None
+
+# Map windows, in days, to lists of Posts with 'summary' fields, most-viewed
+# first, or to None if not ranked yet.
+_rankings = {}
+
+# Incremented when any ranking changes.
+_generation = 0
+
+_refreshing = False
+_refresh_again = False
+
+
+def popular(days):
+    """The most-viewed posts in the last `days` days, or None.
+
+    Returns None if rankings haven't started, or this window isn't ranked
+    yet.
+    """
+    if not _application:
+        return None
+
+    if days not in _rankings:
+        _rankings[days] = None
+        IOLoop.current().add_callback(refresh)
+
+    return _rankings[days]
+
+
+def generation():
+    return _generation
+
+
+@gen.coroutine
+def rank(application, days, limit=MAX_RANKED):
+    """Query the published posts most viewed in the last `days` days."""
+    db = application.settings['db']
+    since = view_counts.today() - datetime.timedelta(days=days - 1)
+
+    # Other pages, like the home page, have views too.
+    views = yield view_counts.views(db, since=since, limit=4 * limit)
+    slugs = []
+    for path, n in views:
+        slug = path.rstrip('/').rsplit('/', 1)[-1]
+        if application.reverse_url('post', slug) == path:
+            slugs.append(slug)
+
+    docs = yield db.posts.find(
+        {'status': 'publish', 'type': 'post', 'slug': {'$in': slugs}},
+        Post.projection('summary')).to_list(None)
+
+    order = dict((slug, i) for i, slug in enumerate(slugs))
+    docs.sort(key=lambda doc: order[doc['slug']])
+    raise gen.Return([Post(**doc) for doc in docs[:limit]])
+
+
+@gen.coroutine
+def refresh():
+    """Rank posts in each window that widgets have asked for."""
+    global _generation, _refreshing, _refresh_again
+    if _refreshing:
+        # Refresh once more when the current run is done.
+        _refresh_again = True
+        return
+
+    _refreshing = True
+    try:
+        while _application:
+            _refresh_again = False
+            changed = False
+            for days in list(_rankings):
+                try:
+                    posts = yield rank(_application, days)
+                except Exception:
+                    logging.exception('Ranking posts viewed in %d days', days)
+                    continue
+
+                if _signature(posts) != _signature(_rankings.get(days)):
+                    changed = True
+
+                _rankings[days] = posts
+
+            if changed:
+                _generation += 1
+                page_cache.evict([page_cache.POPULAR_KEY])
+
+            if not _refresh_again:
+                break
+    finally:
+        _refreshing = False
+
+
+def _signature(posts):
+    if posts is None:
+        return None
+
+    return [(post.id, post.mod) for post in posts]
+
+
+def _on_event(event):
+    IOLoop.current().add_callback(refresh)
+
+
+def start(application, interval=600):
+    """Rank posts every `interval` seconds, and after posts change."""
+    global _application, _periodic
+    _application = application
+    _periodic = PeriodicCallback(refresh, interval * 1000)
+    _periodic.start()
+    for event_name in RANK_EVENTS:
+        cache.on(event_name, _on_event)
+
+
+def stop():
+    """Stop ranking posts, and forget rankings."""
+    global _application, _periodic
+    if _periodic:
+        _periodic.stop()
+
+    for event_name in RANK_EVENTS:
+        cache.remove_callback(event_name, _on_event)
+
+    _application = _periodic = None
+    _rankings.clear()
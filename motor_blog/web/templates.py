@@ -0,0 +1,205 @@
+"""Compile templates once at startup, and the functions templates call.
+
+Tornado compiles each template the first time it's rendered, and pyjade
+translates Jade templates to Tornado's syntax first, which is slow, so the
+first visitors after a restart wait. compile_all() loads every template under
+a directory and installs the Loader where RequestHandlers find it. Call it
+before forking, so workers share the compiled templates.
+
+With a module directory, the Python code Tornado generates for each template
+is saved there as a module, and later startups load the modules instead of
+running pyjade again. The modules are regenerated when any template changes.
+"""
+
+import hashlib
+import logging
+import os
+import time
+
+import pyjade
+import tornado
+import tornado.web
+from pyjade.ext import tornado as pyjade_tornado
+from pyjade.runtime import attrs, escape, iteration
+from tornado import escape as tornado_escape
+from tornado import template
+
+from motor_blog.text import link
+
+__all__ = ('compile_all', 'TemplateLoader', 'UI_METHODS')
+
+TEMPLATE_EXTENSIONS = ('.jade', '.html')
+
+
+def setting(handler, name):
+    return handler.settings[name]
+
+
+def absolute(handler, relative):
+    return link.absolute(relative)
+
+
+def post_body(handler, post):
+    """A post's HTML, with its widgets rendered."""
+    return handler.post_body(post)
+
+
+def fragment(handler, template_name, post):
+    """Render a template showing one post, see render_fragment()."""
+    return handler.render_fragment(template_name, post)
+
+
+def nav_menu(handler):
+    """The nav_menu option's (url, title, CSS class) triples."""
+    return handler.settings['nav_menu']
+
+
+# Template functions, passed to the Application as ui_methods.
+UI_METHODS = {
+    'setting': setting,
+    'absolute': absolute,
+    'nav_menu': nav_menu,
+    'post_body': post_body,
+    'fragment': fragment,
+}
+
+
+class _GeneratedTemplate(template.Template):
+    """A template built from code that TemplateLoader saved earlier."""
+    def __init__(self, code, name, loader):
+        self.name = name
+        self.autoescape = loader.autoescape
+        self.namespace = loader.namespace
+        self.loader = loader
+        self.code = code
+        self.compiled = compile(
+            tornado_escape.to_unicode(code),
+            "%s.generated.py" % name.replace('.', '_'),
+            "exec", dont_inherit=True)
+
+
+class TemplateLoader(template.Loader):
+    """Loads templates, and optionally saves their code in `module_dir`."""
+    def __init__(self, root_directory, module_dir=None, **kwargs):
+        super(TemplateLoader, self).__init__(root_directory, **kwargs)
+        self.module_dir = module_dir and os.path.abspath(module_dir)
+
+        # Generated Jade templates call these, pyjade usually adds them.
+        self.namespace.update({
+            pyjade_tornado.ATTRS_FUNC: attrs,
+            pyjade_tornado.ESCAPE_FUNC: escape,
+            pyjade_tornado.ITER_FUNC: iteration})
+
+        self.fingerprint = None
+        self.modules_fresh = False
+        self._check_modules()
+
+    def reset(self):
+        super(TemplateLoader, self).reset()
+        self._check_modules()
+
+    def save_module(self, name):
+        """Save a loaded template's generated code as a module."""
+        code = tornado_escape.utf8(self.load(name).code)
+        with open(self._module_path(name), 'wb') as f:
+            f.write(code)
+
+    def save_fingerprint(self):
+        """Mark the saved modules as generated from the current templates."""
+        with open(os.path.join(self.module_dir, '__init__.py'), 'w') as f:
+            f.write('FINGERPRINT = %r\n' % self.fingerprint)
+
+        self.modules_fresh = True
+
+    def _check_modules(self):
+        if not self.module_dir:
+            return
+
+        self.fingerprint = _fingerprint(self.root)
+        try:
+            namespace = {}
+            with open(os.path.join(self.module_dir, '__init__.py')) as f:
+                exec f.read() in namespace
+
+            self.modules_fresh = (
+                namespace.get('FINGERPRINT') == self.fingerprint)
+        except IOError:
+            self.modules_fresh = False
+
+    def _module_path(self, name):
+        module_name = name.replace(os.sep, '_').replace('.', '_').replace(
+            '-', '_')
+
+        return os.path.join(self.module_dir, module_name + '.py')
+
+    def _create_template(self, name):
+        if self.modules_fresh:
+            path = self._module_path(name)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return _GeneratedTemplate(f.read(), name, self)
+
+        return super(TemplateLoader, self)._create_template(name)
+
+
+def _fingerprint(root):
+    # Generated code depends on the templates, pyjade, and Tornado.
+    md5 = hashlib.md5(
+        '%s %s' % (getattr(pyjade, '__version__', ''), tornado.version))
+
+    for name in _template_names(root):
+        md5.update(name)
+        with open(os.path.join(root, name), 'rb') as f:
+            md5.update(f.read())
+
+    return md5.hexdigest()
+
+
+def _template_names(root, subdirectory=''):
+    names = []
+    for dirpath, dirnames, filenames in os.walk(
+            os.path.join(root, subdirectory)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(TEMPLATE_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                names.append(os.path.relpath(path, root))
+
+    return names
+
+
+def compile_all(template_path, subdirectory='', module_dir=None):
+    """Compile the templates under `template_path`, return the Loader.
+
+    Only templates in `subdirectory` of `template_path` are compiled, if it's
+    given. Handlers whose get_template_path() returns `template_path` use
+    the Loader.
+    """
+    if module_dir and not os.path.isdir(module_dir):
+        os.makedirs(module_dir)
+
+    loader = TemplateLoader(template_path, module_dir)
+    from_modules = loader.modules_fresh
+    start = time.time()
+    for name in _template_names(template_path, subdirectory):
+        template_start = time.time()
+        loader.load(name)
+        if module_dir and not from_modules:
+            loader.save_module(name)
+
+        logging.info(
+            'Compiled %s in %.1f ms', name,
+            1000 * (time.time() - template_start))
+
+    if module_dir and not from_modules:
+        loader.save_fingerprint()
+
+    logging.info(
+        'Compiled templates in %s in %.1f ms%s', template_path,
+        1000 * (time.time() - start),
+        ' from modules' if from_modules else '')
+
+    with tornado.web.RequestHandler._template_loader_lock:
+        tornado.web.RequestHandler._template_loaders[template_path] = loader
+
+    return loader
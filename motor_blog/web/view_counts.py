@@ -0,0 +1,108 @@
+"""Count page and post views per day, in MongoDB.
+
+Views are counted in memory, keyed by path and day, and flush() saves the
+counts periodically with one bulk write of upserts that $inc each path's
+document for the day, instead of writing once per view. Each worker counts
+and flushes its own views; the $inc's add up.
+
+Feed readers' views are counted by the tracking pixel, and web pages' views
+by MotorBlogHandler if the count_page_views option is set. Both use the
+page's path, like '/blog/my-post/', so views() adds them up.
+"""
+
+import collections
+import datetime
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from tornado import gen
+from tornado.ioloop import PeriodicCallback
+
+__all__ = ('count', 'flush', 'start', 'stop', 'views')
+
+# Map (path, day) to views not yet flushed.
+_counts = collections.Counter()
+
+# The PeriodicCallback that flushes counts, see start().
+_flusher = None
+
+
+def today():
+    """Midnight UTC."""
+    now = datetime.datetime.utcnow()
+    return datetime.datetime(now.year, now.month, now.day)
+
+
+def count(path):
+    """Count a view of `path` today, if counting has started."""
+    if _flusher:
+        _counts[(path, today())] += 1
+
+
+@gen.coroutine
+def flush(db):
+    """Save the counts so far."""
+    global _counts
+    counts, _counts = _counts, collections.Counter()
+    if not counts:
+        return
+
+    items = sorted(counts.items())
+    requests = [
+        UpdateOne(
+            {'path': path, 'day': day}, {'$inc': {'views': n}}, upsert=True)
+        for (path, day), n in items]
+
+    try:
+        yield db.views.bulk_write(requests, ordered=False)
+    except BulkWriteError as exc:
+        logging.error('Saving view counts, will retry: %s', exc)
+
+        # The other updates were applied.
+        for error in exc.details['writeErrors']:
+            key, n = items[error['index']]
+            _counts[key] += n
+    except Exception:
+        logging.exception('Saving view counts, will retry')
+
+        # Assume none were saved; some views may be counted twice.
+        _counts.update(counts)
+
+
+def start(db, interval=60):
+    """Count views, and flush counts every `interval` seconds."""
+    global _flusher
+    _flusher = PeriodicCallback(lambda: flush(db), interval * 1000)
+    _flusher.start()
+
+
+def stop():
+    """Stop counting views. Counts not yet flushed are discarded."""
+    global _flusher
+    if _flusher:
+        _flusher.stop()
+        _flusher = None
+        _counts.clear()
+
+
+@gen.coroutine
+def views(db, since=None, limit=None):
+    """Most-viewed paths, as a list of (path, views) pairs.
+
+    Counts views on or after the datetime `since`, or ever.
+    """
+    pipeline = []
+    if since:
+        pipeline.append({'$match': {'day': {'$gte': since}}})
+
+    pipeline += [
+        {'$group': {'_id': '$path', 'views': {'$sum': '$views'}}},
+        {'$sort': {'views': -1, '_id': 1}},
+    ]
+
+    if limit:
+        pipeline.append({'$limit': limit})
+
+    docs = yield db.views.aggregate(pipeline).to_list(None)
+    raise gen.Return([(doc['_id'], doc['views']) for doc in docs])
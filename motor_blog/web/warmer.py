@@ -0,0 +1,202 @@
+"""Render popular pages into the page cache before visitors ask for them.
+
+After a restart, or after an event evicts pages, the first visitor to each
+page waits for it to render. The warmer renders the home page, the first
+few pages of recent posts, every category and its feed, the most-used tags,
+and the main feed in the background, a few at a time so it doesn't compete
+with live requests.
+
+Pages are rendered inside this process by passing requests directly to the
+Application, so they land in this process's page cache.
+"""
+
+import logging
+import urllib
+
+from tornado import gen, httputil
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from motor_blog import cache
+from motor_blog.models import Post
+from motor_blog.web import handlers, page_cache, post_index
+
+__all__ = ('start', 'hot_uris', 'warm', 'render')
+
+# Events after which pages may need re-rendering. See page_cache.
+WARM_EVENTS = (
+    'post_created', 'post_changed', 'post_deleted', 'categories_changed',
+    cache.FLUSH_EVENT)
+
+_warming = False
+_warm_again = False
+
+
+class _WarmupConnection(object):
+    """Stands in for an HTTP connection, and discards the response."""
+    def __init__(self):
+        self.finished = Future()
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write_headers(self, start_line, headers, chunk=None, callback=None):
+        return self._written(callback)
+
+    def write(self, chunk, callback=None):
+        return self._written(callback)
+
+    def finish(self):
+        self.finished.set_result(None)
+
+    def _written(self, callback):
+        if callback:
+            IOLoop.current().add_callback(callback)
+
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+def render(application, uri, headers=None):
+    """Render a page as if for a GET request, return a Future.
+
+    Tornado logs errors as usual, and the Future resolves when the page is
+    done. Pass request `headers` as a dict.
+    """
+    connection = _WarmupConnection()
+    request = httputil.HTTPServerRequest(
+        method='GET',
+        uri=uri,
+        headers=httputil.HTTPHeaders(headers or {}),
+        connection=connection,
+        host=application.settings['host'])
+
+    # Not a visitor's view, see view_counts.
+    request.warmup = True
+    application(request)
+    return connection.finished
+
+
+@gen.coroutine
+def hot_uris(application, pages, tags):
+    """URIs of the pages to warm.
+
+    `pages` is how many pages of recent posts, `tags` how many of the
+    most-used tags.
+    """
+    db = application.settings['db']
+    reverse_url = application.reverse_url
+    uris = [reverse_url('home'), reverse_url('feed')]
+    if application.settings['home_page']:
+        list_url = reverse_url('page', 0)
+        uris.append(list_url)
+    else:
+        list_url = reverse_url('home')
+
+    if pages > 1:
+        # Older pages' URLs are keyed on the last post of the previous page.
+        page_size = handlers.RecentPostsHandler.page_size
+        posts = post_index.newest(0, (pages - 1) * page_size)
+        if posts is None:
+            docs = yield db.posts.find(
+                {'status': 'publish', 'type': 'post'},
+                Post.projection('nav'),
+                sort=[('pub_date', -1), ('_id', -1)],
+                limit=(pages - 1) * page_size).to_list(None)
+
+            posts = [Post(**doc) for doc in docs]
+
+        for post in posts[page_size - 1::page_size]:
+            cursor = handlers.page_cursor(post.pub_date, post.id)
+            uris.append('%s?%s' % (
+                list_url, urllib.urlencode({'before': cursor})))
+
+    categories = yield db.categories.find({}, {'slug': True}).to_list(None)
+    for category in categories:
+        uris.append(reverse_url('category', category['slug']))
+        uris.append(reverse_url('category-feed', category['slug']))
+
+    if tags:
+        tag_counts = yield db.posts.aggregate([
+            {'$match': {'status': 'publish', 'type': 'post'}},
+            {'$unwind': '$tags'},
+            {'$group': {'_id': '$tags', 'n': {'$sum': 1}}},
+            {'$sort': {'n': -1}},
+            {'$limit': tags},
+        ]).to_list(None)
+
+        uris += [reverse_url('tag', doc['_id']) for doc in tag_counts]
+
+    raise gen.Return(uris)
+
+
+@gen.coroutine
+def warm(application, uris, concurrency):
+    """Render pages, at most `concurrency` at once.
+
+    Pages already in the page cache are served from it, so cost little.
+    """
+    uris = list(uris)
+
+    @gen.coroutine
+    def worker():
+        while uris:
+            yield render(application, uris.pop(0))
+
+    yield [worker() for _ in range(concurrency)]
+
+
+def start(application, pages=5, tags=10, concurrency=2, delay=1):
+    """Warm the page cache now and after events that evict pages.
+
+    Events within `delay` seconds are handled once, and events that evict no
+    pages, like edits to drafts, are ignored.
+    """
+    # Evictions counted when warming last began, and the pending re-warm.
+    warmed = {'evictions': None, 'timeout': None}
+
+    @gen.coroutine
+    def warm_hot_uris():
+        global _warming, _warm_again
+        if _warming:
+            # Warm once more when the current run is done.
+            _warm_again = True
+            return
+
+        _warming = True
+        try:
+            while True:
+                _warm_again = False
+                warmed['evictions'] = page_cache.evictions()
+                try:
+                    uris = yield hot_uris(application, pages, tags)
+                    yield warm(application, uris, concurrency)
+                    logging.info('Warmed %d pages', len(uris))
+                except Exception:
+                    logging.exception('Warming page cache')
+
+                if not _warm_again:
+                    break
+        finally:
+            _warming = False
+
+    def maybe_warm():
+        warmed['timeout'] = None
+        if page_cache.evictions() != warmed['evictions']:
+            warm_hot_uris()
+
+    def on_event(event):
+        # Let page_cache evict pages before checking, and wait for more
+        # events.
+        if warmed['timeout'] is None:
+            warmed['timeout'] = IOLoop.current().call_later(
+                delay, maybe_warm)
+
+    if not page_cache.enabled():
+        return
+
+    for event_name in WARM_EVENTS:
+        cache.on(event_name, on_event)
+
+    IOLoop.current().add_callback(warm_hot_uris)
@@ -1,57 +1,90 @@
 """Process "widgets" in blog posts.
 
-I've added a silly syntax for widgets in Markdown. The only widget supported
-shows summaries of the N most recent posts, optionally with a tag:
+I've added a silly syntax for widgets in Markdown. One widget shows
+summaries of the N most recent posts, optionally with a tag:
 
     !!recent-posts 10 tag!!
+
+Another shows the N most-viewed posts in the last few days, if views are
+counted, see rankings.py:
+
+    !!popular-posts 10 30d!!
 """
 
 import cStringIO
-import re
 
 from tornado import gen
+from tornado.escape import utf8
 
+from motor_blog import cache
 from motor_blog.models import Post
+from motor_blog.web import page_cache, rankings
 
-__all__ = ('process_widgets',)
+__all__ = ('render_segments',)
 
-widget_pat = re.compile(r'<widget>(.*?)</widget>', re.MULTILINE)
+# Widgets show posts, so their cached output is cleared when posts change.
+WIDGET_EVENTS = ('post_created', 'post_changed', 'post_deleted')
 
 
 @gen.coroutine
-def process_widgets(handler, db, html):
-    """Render widgets. Returns (HTML, last_modified).
+def render_segments(handler, db, segments):
+    """Render widgets in a post. Returns (HTML, last_modified).
 
-    Take a RequestHandler, a MotorDatabase, and HTML text, return HTML with
-    widgets rendered, and the maximum modified date.
+    Take a RequestHandler, a MotorDatabase, and a Post's segments, return
+    HTML with widgets rendered, and the maximum modified date. Widgets are
+    rendered concurrently, and each widget's output is cached by its name and
+    options.
     """
-    rv = cStringIO.StringIO()
+    widgets = []
+    for text in segments[1::2]:
+        parts = text.split()
+        if parts and parts[0] in all_widgets:
+            widgets.append(render_widget(handler, db, *parts))
+        else:
+            widgets.append(None)
 
-    pos = 0
+    results = yield [w for w in widgets if w]
+    results = iter(results)
+
+    rv = cStringIO.StringIO()
     modified = None
-    for match in widget_pat.finditer(html):
-        parts = [p.strip() for p in match.group(1).split() if p.strip()]
-        if parts:
-            widget_name, options = parts[0], parts[1:]
-            if widget_name in all_widgets:
-                f = all_widgets[widget_name]
-                widget_html, m = yield f(handler, db, *options)
-
-                # Track latest last-modified value from all widgets.
-                if not modified or m > modified:
-                    modified = m
-
-                # Text before the match.
-                rv.write(html[pos:match.start()])
-
-                # Replace widget with rendered version.
-                rv.write(widget_html)
-                pos = match.end()
-
-    rv.write(html[pos:])
+    for i, segment in enumerate(segments):
+        if i % 2 == 0:
+            rv.write(utf8(segment))
+        elif widgets[i // 2] is None:
+            # Leave unknown widgets as they were.
+            rv.write(utf8('<widget>%s</widget>' % segment))
+        else:
+            widget_html, m, keys = next(results)
+
+            # Track latest last-modified value from all widgets.
+            if not modified or m > modified:
+                modified = m
+
+            handler.add_surrogate_keys(*keys)
+            rv.write(widget_html)
+
     raise gen.Return((rv.getvalue(), modified))
 
 
+def widget_key(handler, db, widget_name, *options):
+    key = (widget_name, ) + options
+    if widget_name == 'popular-posts':
+        # Render again when the rankings change.
+        key += (rankings.generation(), )
+
+    return key
+
+
+@cache.memoized(WIDGET_EVENTS, max_entries=100, key=widget_key)
+@gen.coroutine
+def render_widget(handler, db, widget_name, *options):
+    """Render a widget. Returns (HTML, last_modified, surrogate keys)."""
+    f = all_widgets[widget_name]
+    result = yield f(handler, db, *options)
+    raise gen.Return(result)
+
+
 @gen.coroutine
 def recent_posts(handler, db, n, tag=None):
     """Show summaries of N most recent posts."""
@@ -60,18 +93,41 @@ def recent_posts(handler, db, n, tag=None):
     if tag:
         query['tags'] = tag
 
-    cursor = db.posts.find(query, {'original': False})
+    cursor = db.posts.find(query, Post.projection('summary'))
     docs = yield cursor.sort([('pub_date', -1)]).limit(limit).to_list(limit)
     posts = [Post(**doc) for doc in docs]
+    list_key = page_cache.tag_key(tag) if tag else page_cache.LIST_KEY
+    raise gen.Return(post_list(handler, posts, list_key))
+
+
+@gen.coroutine
+def popular_posts(handler, db, n, window='30d'):
+    """Show summaries of the N most-viewed posts in a window like '30d'.
+
+    Looks up the ranking in memory. Nothing is shown until it's computed.
+    """
+    posts = rankings.popular(int(window.rstrip('d'))) or []
+    raise gen.Return(
+        post_list(handler, posts[:int(n)], page_cache.POPULAR_KEY))
+
+
+def post_list(handler, posts, list_key):
+    """Render post summaries. Returns (HTML, last_modified, surrogate keys).
+    """
     modified = max(p.last_modified for p in posts) if posts else None
+    keys = frozenset(
+        [list_key] + [page_cache.post_key(post.id) for post in posts])
 
     rv = cStringIO.StringIO()
     rv.write('<ul class="post-list">')
     for post in posts:
-        rv.write(handler.render_string('post-summary.jade', post=post))
+        rv.write(handler.render_fragment('post-summary.jade', post))
 
     rv.write('</ul>')
-    raise gen.Return((rv.getvalue(), modified))
+    return rv.getvalue(), modified, keys
 
 
-all_widgets = {'recent-posts': recent_posts}
+all_widgets = {
+    'recent-posts': recent_posts,
+    'popular-posts': popular_posts,
+}
@@ -4,16 +4,18 @@ import logging
 import os
 
 import motor
-import pymongo
 import tornado.ioloop
 import tornado.web
 from tornado.options import options as opts
-from tornado import httpserver
+from tornado import gen, httpserver, netutil, process
 
 from tornado import template
 
 from motor_blog.options import define_options
 from motor_blog import indexes, cache, application
+from motor_blog.web import (
+    lytics, post_index, purge, rankings, templates, view_counts, warmer)
+from motor_blog.web.admin import ADMIN_TEMPLATE_PATH
 
 # Patch Tornado with the Jade template loader
 from pyjade.ext.tornado import patch_tornado
@@ -27,6 +29,13 @@ template  # silence warning
 # TODO: sitemap.xml
 
 
+@gen.coroutine
+def prepare_database(db):
+    yield cache.create_events_collection(db)
+    if opts.rebuild_indexes or opts.ensure_indexes:
+        yield indexes.ensure_indexes(db, drop=opts.rebuild_indexes)
+
+
 if __name__ == "__main__":
     define_options(opts)
     opts.parse_command_line()
@@ -35,22 +44,65 @@ if __name__ == "__main__":
             print 'Logging to', handler.baseFilename
             break
 
-    db = motor.MotorClient(opts.mongo_uri).get_default_database()
-    loop = tornado.ioloop.IOLoop.current()
-    loop.run_sync(partial(cache.startup, db))
+    # Tornado forbids creating the global IOLoop before forking, so prepare
+    # the database on a private loop and client.
+    prepare_loop = tornado.ioloop.IOLoop(make_current=False)
+    client = motor.MotorClient(opts.mongo_uri, io_loop=prepare_loop)
+    prepare_loop.run_sync(
+        partial(prepare_database, client.get_default_database()))
 
-    if opts.rebuild_indexes or opts.ensure_indexes:
-        ensure_indexes = partial(indexes.ensure_indexes,
-                                 db,
-                                 drop=opts.rebuild_indexes)
+    client.close()
+    prepare_loop.close()
+
+    # Compile before forking, so workers share compiled templates.
+    templates.compile_all(
+        application.get_template_path(opts),
+        module_dir=opts.template_module_dir)
+
+    templates.compile_all(ADMIN_TEMPLATE_PATH, 'admin-templates')
+
+    if not opts.reuse_port:
+        sockets = netutil.bind_sockets(opts.port)
 
-        loop.run_sync(ensure_indexes)
+    if opts.processes != 1:
+        # Each worker has its own MotorClient and caches, kept coherent by
+        # tailing the events collection.
+        process.fork_processes(opts.processes)
+
+    if opts.reuse_port:
+        # The kernel balances connections among workers' sockets.
+        sockets = netutil.bind_sockets(opts.port, reuse_port=True)
+
+    db = motor.MotorClient(opts.mongo_uri).get_default_database()
+    loop = tornado.ioloop.IOLoop.current()
+    loop.run_sync(partial(cache.startup, db, opts.event_coalesce_window))
+    loop.run_sync(partial(post_index.load, db))
 
     this_dir = os.path.dirname(__file__)
     application = application.get_application(this_dir, db, opts)
     http_server = httpserver.HTTPServer(application, xheaders=True)
-    http_server.listen(opts.port)
+    http_server.add_sockets(sockets)
+    if opts.purge_endpoints and not process.task_id():
+        # Only the first worker purges.
+        purge.start(
+            application, opts.purge_endpoints, opts.purge_by_url,
+            opts.purge_method)
+
+    if opts.count_views:
+        view_counts.start(db, opts.view_count_interval)
+        rankings.start(application, opts.ranking_interval)
+
+    if opts.google_analytics_rss_id:
+        lytics.start(opts.analytics_batch_uri, opts.analytics_queue_size)
+
+    if opts.warm_concurrency:
+        warmer.start(
+            application, opts.warm_pages, opts.warm_tags, opts.warm_concurrency)
+
     msg = 'Listening on port %s' % opts.port
+    if opts.processes != 1:
+        msg += ', process %d' % process.task_id()
+
     print msg
     logging.info(msg)
     loop.start()
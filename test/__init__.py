@@ -34,11 +34,13 @@ class MotorBlogTest(AsyncHTTPTestCase):
         sync_client = pymongo.mongo_client.MongoClient()
         self.sync_db = sync_client[self.database_name]
         for collection_name in [
+                'counters',
                 'events',
                 'fs.chunks',
                 'fs.files',
                 'posts',
-                'categories']:
+                'categories',
+                'views']:
             self.sync_db.drop_collection(collection_name)
 
         self.patchers = []
@@ -91,6 +93,10 @@ class MotorBlogTest(AsyncHTTPTestCase):
 
         return application.get_application('..', db, tornado.options.options)
 
+    def posts_changed(self):
+        """Invalidate caches after modifying posts directly in MongoDB."""
+        cache._on_event({'name': 'post_changed'})
+
     def reverse_url(self, name, *args):
         return self._app.reverse_url(name, *args)
 
@@ -150,6 +156,8 @@ class MotorBlogTest(AsyncHTTPTestCase):
                 {'_id': ObjectId(post_id)},
                 {'$set': {'pub_date': created}})
 
+            self.posts_changed()
+
         return post_id
 
     def edit_post(
@@ -184,6 +192,8 @@ class MotorBlogTest(AsyncHTTPTestCase):
                 {'_id': ObjectId(post_id)},
                 {'$set': {'mod': updated}})
 
+            self.posts_changed()
+
         return post_id
 
     def new_post(
@@ -0,0 +1,266 @@
+import time
+import unittest
+
+import mock
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from motor_blog import cache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_max_entries(self):
+        lru = cache.LRUCache(max_entries=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(1, lru.get('a'))  # Now 'b' is least recently used.
+        lru.set('c', 3)
+        self.assertEqual(2, len(lru))
+        self.assertTrue('a' in lru)
+        self.assertFalse('b' in lru)
+        self.assertTrue('c' in lru)
+
+    def test_max_bytes(self):
+        lru = cache.LRUCache(max_bytes=10)
+        lru.set('a', 'x' * 4)
+        lru.set('b', 'x' * 4)
+        self.assertEqual(8, lru.nbytes)
+        lru.set('c', 'x' * 4)
+        self.assertFalse('a' in lru)
+        self.assertEqual(8, lru.nbytes)
+
+        # Too big to store at all.
+        lru.set('d', 'x' * 11)
+        self.assertFalse('d' in lru)
+        self.assertEqual(2, len(lru))
+
+    def test_pop_and_clear(self):
+        lru = cache.LRUCache(max_bytes=10)
+        lru.set('a', 'xx')
+        self.assertEqual('xx', lru.pop('a'))
+        self.assertEqual(None, lru.pop('a'))
+        self.assertEqual(0, lru.nbytes)
+        lru.set('b', 'xx')
+        lru.clear()
+        self.assertEqual(0, len(lru))
+        self.assertEqual(0, lru.nbytes)
+
+
+class MemoizedTest(AsyncTestCase):
+    def setUp(self):
+        super(MemoizedTest, self).setUp()
+        self.calls = []
+
+    def make_function(self, **kwargs):
+        @cache.memoized('test_event', **kwargs)
+        @gen.coroutine
+        def f(x, y=None):
+            self.calls.append((x, y))
+            raise gen.Return(len(self.calls))
+
+        return f
+
+    @gen_test
+    def test_arguments(self):
+        f = self.make_function()
+        self.assertEqual(1, (yield f(1)))
+        self.assertEqual(1, (yield f(1)))
+        self.assertEqual(2, (yield f(1, y={'a': [1]})))
+        self.assertEqual(2, (yield f(1, y={'a': [1]})))
+        self.assertEqual(3, (yield f(2)))
+        self.assertEqual(3, len(self.calls))
+
+    @gen_test
+    def test_invalidate_event(self):
+        f = self.make_function()
+        self.assertEqual(1, (yield f(1)))
+        cache._on_event({'name': 'other_event'})
+        self.assertEqual(1, (yield f(1)))
+        cache._on_event({'name': 'test_event'})
+        self.assertEqual(2, (yield f(1)))
+
+    @gen_test
+    def test_ttl(self):
+        f = self.make_function(ttl=10)
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            self.assertEqual(1, (yield f(1)))
+
+        with mock.patch('time.time', return_value=now + 9):
+            self.assertEqual(1, (yield f(1)))
+
+        with mock.patch('time.time', return_value=now + 11):
+            self.assertEqual(2, (yield f(1)))
+
+    @gen_test
+    def test_max_entries(self):
+        f = self.make_function(max_entries=1)
+        yield f(1)
+        yield f(2)
+        yield f(1)
+        self.assertEqual([(1, None), (2, None), (1, None)], self.calls)
+
+    @gen_test
+    def test_single_flight(self):
+        f = self.make_function()
+        results = yield [f(1), f(1), f(1), f(2)]
+        self.assertEqual([1, 1, 1, 2], results)
+        self.assertEqual([(1, None), (2, None)], self.calls)
+
+    @gen_test
+    def test_single_flight_error(self):
+        @cache.memoized('test_event')
+        @gen.coroutine
+        def f():
+            self.calls.append(None)
+            yield gen.moment
+            raise ValueError()
+
+        futures = [f(), f()]
+        for future in futures:
+            with self.assertRaises(ValueError):
+                yield future
+
+        self.assertEqual(1, len(self.calls))
+
+        # Not cached.
+        with self.assertRaises(ValueError):
+            yield f()
+
+        self.assertEqual(2, len(self.calls))
+
+    @gen_test
+    def test_single_flight_invalidate(self):
+        @cache.memoized('test_event')
+        @gen.coroutine
+        def f():
+            self.calls.append(None)
+            n = len(self.calls)
+            yield gen.moment
+            raise gen.Return(n)
+
+        future = f()
+        cache._on_event({'name': 'test_event'})
+
+        # Doesn't share the call that began before the invalidation.
+        self.assertEqual(2, (yield f()))
+        self.assertEqual(1, (yield future))
+        self.assertEqual(2, (yield f()))
+
+
+class EventSequenceTest(AsyncTestCase):
+    def setUp(self):
+        super(EventSequenceTest, self).setUp()
+        self.events = []
+        cache.on(None, self.on_event)
+        for patcher in [
+                mock.patch.object(cache, '_last_seq', 10),
+                mock.patch.object(cache, 'GAP_TIMEOUT', 0.01)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        cache.remove_callback(None, self.on_event)
+        cache.shutdown()
+        super(EventSequenceTest, self).tearDown()
+
+    def on_event(self, event):
+        self.events.append(event)
+
+    def names(self):
+        return [e['name'] for e in self.events]
+
+    def test_in_order(self):
+        cache._on_tailed_event({'name': 'a', 'seq': 11})
+        cache._on_tailed_event({'name': 'b', 'seq': 12})
+        self.assertEqual(['a', 'b'], self.names())
+        self.assertEqual(12, cache._last_seq)
+
+    @gen_test
+    def test_gap(self):
+        cache._on_tailed_event({'name': 'a', 'seq': 13})
+        yield gen.sleep(0.02)
+        self.assertEqual(['a', cache.FLUSH_EVENT], self.names())
+
+        # Event 12 inserted too late; no second flush.
+        cache._on_tailed_event({'name': 'b', 'seq': 12})
+        yield gen.sleep(0.02)
+        self.assertEqual(['a', cache.FLUSH_EVENT, 'b'], self.names())
+        self.assertEqual(13, cache._last_seq)
+
+    @gen_test
+    def test_late(self):
+        # Another process's events 11 and 12 arrive after 13.
+        cache._on_tailed_event({'name': 'a', 'seq': 13})
+        cache._on_tailed_event({'name': 'b', 'seq': 11})
+        cache._on_tailed_event({'name': 'c', 'seq': 12})
+        yield gen.sleep(0.02)
+        self.assertEqual(['a', 'b', 'c'], self.names())
+
+    def test_large_gap(self):
+        # E.g., the capped collection wrapped around.
+        cache._on_tailed_event(
+            {'name': 'a', 'seq': 11 + cache.MAX_LATE_EVENTS + 1})
+
+        self.assertEqual([cache.FLUSH_EVENT, 'a'], self.names())
+
+
+class EventTest(AsyncTestCase):
+    def setUp(self):
+        super(EventTest, self).setUp()
+        db = mock.Mock()
+        db.counters.find_one_and_update.side_effect = self.find_one_and_update
+        db.events.insert.side_effect = self.insert
+        self.insert_error = None
+        for patcher in [
+                mock.patch.object(cache, '_db', db),
+                mock.patch.object(cache, 'EVENT_TIMEOUT', 0.01)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @gen.coroutine
+    def find_one_and_update(self, *args, **kwargs):
+        raise gen.Return({'seq': 1})
+
+    @gen.coroutine
+    def insert(self, doc, **kwargs):
+        if self.insert_error:
+            raise self.insert_error
+
+    @gen_test
+    def test_timeout(self):
+        # Not tailing, so the event is never received.
+        yield cache.event('post_changed')
+        self.assertEqual({}, cache._waiters)
+
+    @gen_test
+    def test_insert_error(self):
+        self.insert_error = ValueError()
+        with self.assertRaises(ValueError):
+            yield cache.event('post_changed')
+
+        self.assertEqual({}, cache._waiters)
+
+
+class CoalesceTest(unittest.TestCase):
+    def test_coalesce(self):
+        merged = cache.coalesce([
+            {'name': 'post_changed', 'seq': 1, 'posts': [{'id': 1}]},
+            {'name': 'post_changed', 'seq': 2, 'posts': [{'id': 2}]},
+            {'name': 'categories_changed', 'seq': 3},
+            {'name': 'post_changed', 'seq': 4, 'posts': [{'id': 3}]}])
+
+        # Only consecutive events are merged, so the order is kept.
+        self.assertEqual([
+            {'name': 'post_changed', 'seq': 2, 'ts': None,
+             'posts': [{'id': 1}, {'id': 2}]},
+            {'name': 'categories_changed', 'seq': 3},
+            {'name': 'post_changed', 'seq': 4, 'posts': [{'id': 3}]}], merged)
+
+    def test_coalesce_without_posts(self):
+        merged = cache.coalesce([
+            {'name': 'post_changed', 'seq': 1, 'posts': [{'id': 1}]},
+            {'name': 'post_changed', 'seq': 2}])
+
+        self.assertEqual(
+            [{'name': 'post_changed', 'seq': 2, 'ts': None}], merged)
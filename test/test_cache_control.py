@@ -0,0 +1,69 @@
+import unittest
+
+from motor_blog.web import handlers, page_cache
+from motor_blog.text import slugify
+import test  # Motor-Blog project's test/__init__.py.
+
+
+class CacheControlHeaderTest(unittest.TestCase):
+    def test_cache_control_header(self):
+        self.assertEqual(
+            'public, max-age=60, s-maxage=300, stale-while-revalidate=60',
+            handlers.cache_control_header(handlers.CACHE_POLICIES['list']))
+
+        self.assertEqual(
+            'public, s-maxage=10',
+            handlers.cache_control_header({'s_maxage': 10}))
+
+        self.assertEqual(
+            'private, no-cache',
+            handlers.cache_control_header({'private': True, 'max_age': 1}))
+
+
+class CacheControlTest(test.MotorBlogTest):
+    def get_app(self):
+        self.set_option('cache_control', {'search': {'max_age': 5}})
+        return super(CacheControlTest, self).get_app()
+
+    def test_post(self):
+        post_id = self.new_post(title='the title')
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        for _ in range(2):
+            # Rendered, then from the page cache.
+            response = self.fetch(url)
+            self.assertEqual(
+                'public, max-age=300, s-maxage=3600,'
+                ' stale-while-revalidate=300',
+                response.headers['Cache-Control'])
+
+            self.assertEqual('Accept-Encoding', response.headers['Vary'])
+            self.assertTrue(
+                page_cache.post_key(post_id)
+                in response.headers['Surrogate-Key'].split())
+
+    def test_feed(self):
+        self.new_post(title='the title')
+        response = self.fetch(self.reverse_url('feed'))
+        self.assertTrue(
+            response.headers['Cache-Control'].startswith('public'))
+
+        self.assertTrue(
+            page_cache.LIST_KEY in response.headers['Surrogate-Key'].split())
+
+    def test_override(self):
+        response = self.fetch(self.reverse_url('search') + '?q=foo')
+        self.assertEqual('public, max-age=5', response.headers['Cache-Control'])
+
+    def test_private(self):
+        self.new_post(title='the title')
+        for url in (
+                self.reverse_url('drafts'),
+                self.reverse_url('draft', slugify.slugify('the title'))):
+            response = self.fetch(url, follow_redirects=False)
+            self.assertEqual(
+                'private, no-cache', response.headers['Cache-Control'])
+
+    def test_not_found(self):
+        response = self.fetch(self.reverse_url('post', 'nonexistent'))
+        self.assertEqual(404, response.code)
+        self.assertEqual('no-cache', response.headers['Cache-Control'])
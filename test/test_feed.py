@@ -1,12 +1,38 @@
+import json
+import unittest
 from datetime import datetime
 from xml.etree.ElementTree import fromstring
 
+from motor_blog.models import utc_tz
 from motor_blog.text import slugify
+from motor_blog.web import page_cache
+from motor_blog.web.feed import FORMATS
 import test  # Motor-Blog project's test/__init__.py.
 
 ns = '{http://www.w3.org/2005/Atom}'
 
 
+class FormatTest(unittest.TestCase):
+    def entry(self, summary):
+        return {
+            'title': 'the title',
+            'url': 'http://example.com/blog/the-title/',
+            'content': '<p>the body</p>',
+            'summary': summary,
+            'author': {'name': 'the author', 'email': 'a@example.com'},
+            'published': utc_tz.localize(datetime(2014, 1, 1)),
+        }
+
+    def test_empty_summary(self):
+        atom, json_format = FORMATS['atom'], FORMATS['json']
+        self.assertTrue('<summary' in atom.entry(self.entry('a summary')))
+        self.assertFalse('<summary' in atom.entry(self.entry('')))
+        item = json.loads(json_format.entry(self.entry('a summary')))
+        self.assertEqual('a summary', item['summary'])
+        item = json.loads(json_format.entry(self.entry('')))
+        self.assertFalse('summary' in item)
+
+
 class FeedTest(test.MotorBlogTest):
     def setUp(self):
         super(FeedTest, self).setUp()
@@ -19,6 +45,7 @@ class FeedTest(test.MotorBlogTest):
 
         post_id1 = self.new_post(
             title='other title',
+            tag='a tag',
             created=datetime(2014, 1, 2))
 
         cat_id1 = self.new_category('category 1')
@@ -40,6 +67,8 @@ class FeedTest(test.MotorBlogTest):
             self.reverse_url_absolute('post', slugify.slugify('other title')),
             entries[0].find(ns + 'id').text)
 
+        self.assertTrue('the body' in entries[0].find(ns + 'summary').text)
+
         # Second post.
         self.assertEqual(
             'the title',
@@ -61,3 +90,76 @@ class FeedTest(test.MotorBlogTest):
         self.assertEqual(
             'the title',
             entries[0].find(ns + 'title').text)
+
+    def test_conditional_get(self):
+        url = self.reverse_url('feed')
+        response = self.fetch(url)
+        self.assertEqual(
+            'application/atom+xml; charset=UTF-8',
+            response.headers['Content-Type'])
+
+        self.assertTrue(response.headers['Etag'])
+        for name, value in [
+                ('If-None-Match', response.headers['Etag']),
+                ('If-Modified-Since', response.headers['Last-Modified'])]:
+            self.assertEqual(
+                304, self.fetch(url, headers={name: value}).code)
+
+        # A new post changes the feed.
+        self.new_post(title='newest title', created=datetime(2014, 1, 3))
+        response = self.fetch(url, headers={
+            'If-None-Match': response.headers['Etag']})
+
+        self.assertEqual(200, response.code)
+        self.assertTrue('newest title' in response.body)
+
+    def test_streaming(self):
+        page_cache.configure(0)
+        self.addCleanup(page_cache.configure, 64 * 1024 * 1024)
+        url = self.reverse_url('feed')
+        response = self.fetch(url)
+        self.assertEqual(200, response.code)
+        self.assertEqual(
+            'application/atom+xml; charset=UTF-8',
+            response.headers['Content-Type'])
+
+        self.assertEqual(2, len(fromstring(response.body).findall(
+            ns + 'entry')))
+
+        self.assertEqual(304, self.fetch(url, headers={
+            'If-Modified-Since': response.headers['Last-Modified']}).code)
+
+    def test_rss(self):
+        response = self.fetch(self.reverse_url('feed-rss'))
+        self.assertEqual(200, response.code)
+        self.assertEqual(
+            'application/rss+xml; charset=UTF-8',
+            response.headers['Content-Type'])
+
+        items = fromstring(response.body).find('channel').findall('item')
+        self.assertEqual(
+            ['other title', 'the title'],
+            [item.find('title').text for item in items])
+
+        self.assertEqual(
+            self.reverse_url_absolute('post', slugify.slugify('other title')),
+            items[0].find('guid').text)
+
+    def test_json(self):
+        slug = slugify.slugify('category 0')
+        response = self.fetch(self.reverse_url('category-feed-json', slug))
+        self.assertEqual(200, response.code)
+        feed = json.loads(response.body)
+        self.assertEqual('https://jsonfeed.org/version/1', feed['version'])
+        self.assertEqual(
+            ['the title'], [item['title'] for item in feed['items']])
+
+        self.assertTrue('the body' in feed['items'][0]['summary'])
+
+    def test_tag_feed(self):
+        response = self.fetch(self.reverse_url('tag-feed', 'a tag'))
+        self.assertEqual(200, response.code)
+        entries = fromstring(response.body).findall(ns + 'entry')
+        self.assertEqual(
+            ['other title'],
+            [entry.find(ns + 'title').text for entry in entries])
@@ -0,0 +1,83 @@
+import datetime
+import re
+import unittest
+
+import pytz
+from bson import ObjectId
+
+from motor_blog import cache
+from motor_blog.models import Post
+from motor_blog.web import fragment_cache, page_cache
+import test  # Motor-Blog project's test/__init__.py.
+
+
+class FragmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        fragment_cache.configure(1024)
+
+    def tearDown(self):
+        fragment_cache.configure(16 * 1024 * 1024)
+
+    def test_fragment_key(self):
+        post = Post(id=ObjectId(), mod=datetime.datetime(2014, 1, 1))
+        tz = pytz.timezone('America/New_York')
+        key = fragment_cache.fragment_key('post.jade', post, tz)
+        fragment_cache.put(key, u'<li>\u2603</li>')
+        self.assertEqual(
+            u'<li>\u2603</li>'.encode('utf-8'), fragment_cache.get(key))
+
+        # Another template, timezone, or modification date misses.
+        for other in [
+                fragment_cache.fragment_key('post-summary.jade', post, tz),
+                fragment_cache.fragment_key('post.jade', post, pytz.utc)]:
+            self.assertEqual(None, fragment_cache.get(other))
+
+        post.mod = datetime.datetime(2014, 1, 2)
+        self.assertEqual(None, fragment_cache.get(
+            fragment_cache.fragment_key('post.jade', post, tz)))
+
+        cache._on_event({'name': cache.FLUSH_EVENT})
+        self.assertEqual(None, fragment_cache.get(key))
+
+    def test_max_bytes(self):
+        fragment_cache.put('a', 'x' * 600)
+        fragment_cache.put('b', 'x' * 600)
+        self.assertEqual(None, fragment_cache.get('a'))
+        fragment_cache.configure(0)
+        self.assertFalse(fragment_cache.enabled())
+        self.assertEqual(None, fragment_cache.get('b'))
+
+
+class FragmentCacheRenderTest(test.MotorBlogTest):
+    def fetch_home(self):
+        return self.fetch(self.reverse_url('home')).body
+
+    def test_fragments(self):
+        post_id = self.new_post(title='old title')
+        self.assertTrue('old title' in self.fetch_home())
+
+        # Changed without updating mod, the cached fragment is reused.
+        self.sync_db.posts.update(
+            {'_id': ObjectId(post_id)}, {'$set': {'title': 'new title'}})
+
+        page_cache.invalidate()
+        self.assertTrue('old title' in self.fetch_home())
+
+        # An event that doesn't describe the change clears fragments.
+        self.posts_changed()
+        body = self.fetch_home()
+        self.assertTrue('new title' in body)
+        self.assertFalse('old title' in body)
+
+        # Editing the post changes its mod.
+        self.edit_post(post_id, title='edited title')
+        self.assertTrue('edited title' in self.fetch_home())
+
+    def test_post_page_first(self):
+        self.new_post(title='the title', body='the body')
+        self.fetch(self.reverse_url('post', 'the-title'))
+
+        # The post page's fragment has the summary the home page shows.
+        summary = re.search(
+            r'class="post-summary">(.*?)</div>', self.fetch_home(), re.S)
+        self.assertTrue('the body' in summary.group(1))
@@ -0,0 +1,160 @@
+import urlparse
+
+import mock
+import tornado.web
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from motor_blog.web import lytics, post_index, view_counts
+
+
+class CollectorHandler(tornado.web.RequestHandler):
+    """Stands in for Google Analytics, records batches of hits."""
+    def initialize(self, batches, failures):
+        self.batches = batches
+        self.failures = failures
+
+    def post(self):
+        if self.failures:
+            self.failures.pop()
+            raise tornado.web.HTTPError(503)
+
+        self.batches.append([
+            dict(urlparse.parse_qsl(line))
+            for line in self.request.body.split('\n')])
+
+
+class LyticsTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.batches = []
+        self.failures = []
+        super(LyticsTest, self).setUp()
+
+    def tearDown(self):
+        lytics.stop()
+        view_counts.stop()
+        post_index.unload()
+        super(LyticsTest, self).tearDown()
+
+    def get_app(self):
+        return tornado.web.Application([
+            ('/batch', CollectorHandler,
+             {'batches': self.batches, 'failures': self.failures}),
+            (r'/analytics/(?P<path>.+)/pixel.gif',
+             lytics.TrackingPixelHandler),
+            tornado.web.url(
+                r'/blog/(?P<slug>[^/]+)/', tornado.web.RequestHandler,
+                name='post')],
+            google_analytics_rss_id='UA-TEST')
+
+    def sender(self, **kwargs):
+        return lytics.AnalyticsSender(
+            self.get_url('/batch'), backoff=0.01, **kwargs)
+
+    @gen_test
+    def test_batches(self):
+        sender = self.sender()
+        for i in range(25):
+            sender.track({'el': str(i)})
+
+        for _ in range(2):
+            hits = yield sender.next_batch()
+            yield sender.send(hits)
+
+        self.assertEqual([20, 5], [len(batch) for batch in self.batches])
+        self.assertEqual(
+            [str(i) for i in range(25)],
+            [hit['el'] for batch in self.batches for hit in batch])
+
+        self.assertEqual(
+            {'queued': 0, 'sent': 25, 'dropped': 0, 'failed': 0},
+            sender.stats())
+
+    @gen_test
+    def test_batch_size(self):
+        sender = self.sender()
+        for i in range(3):
+            sender.track({'el': str(i) * 7000})
+
+        hits = yield sender.next_batch()
+        self.assertEqual(2, len(hits))
+        hits = yield sender.next_batch()
+        self.assertEqual(1, len(hits))
+
+        sender.track({'el': 'x' * 9000})
+        self.assertEqual(1, sender.dropped)
+
+    def test_queue_full(self):
+        sender = self.sender(max_queue=3)
+        for i in range(5):
+            sender.track({'el': str(i)})
+
+        self.assertEqual(
+            {'queued': 3, 'sent': 0, 'dropped': 2, 'failed': 0},
+            sender.stats())
+
+    @gen_test
+    def test_retry(self):
+        sender = self.sender()
+        self.failures.extend([True, True])
+        yield sender.send(['el=a'])
+        self.assertEqual(1, len(self.batches))
+        self.assertEqual(1, sender.sent)
+
+        self.failures.extend([True] * 3)
+        yield sender.send(['el=b'])
+        self.assertEqual(1, len(self.batches))
+        self.assertEqual(1, sender.failed)
+
+    @gen_test
+    def test_stop(self):
+        sender = self.sender()
+        running = sender.run()
+        sender.track({'el': 'a'})
+        while not sender.sent:
+            yield gen.sleep(0.01)
+
+        # run() returns, though it was waiting for a hit.
+        sender.stop()
+        yield running
+        self.assertEqual(1, len(self.batches))
+
+    def test_log_stats(self):
+        lytics.start(self.get_url('/batch'), max_queue=1)
+        for i in range(3):
+            lytics._sender.track({'el': str(i)})
+
+        with mock.patch('logging.info') as info:
+            lytics.stop()
+
+        self.assertEqual(
+            'Analytics hits: 1 queued, 0 sent, 2 dropped, 0 failed',
+            info.call_args[0][0] % info.call_args[0][1])
+
+    @gen_test
+    def test_pixel(self):
+        sender = lytics.start(self.get_url('/batch'))
+        response = yield self.http_client.fetch(
+            self.get_url('/analytics/blog/the-slug/pixel.gif'))
+
+        self.assertEqual(lytics.gif, response.body)
+        while not self.batches:
+            yield gen.sleep(0.01)
+
+        [[hit]] = self.batches
+        self.assertEqual('UA-TEST', hit['tid'])
+        self.assertEqual('blog/the-slug', hit['el'])
+        self.assertEqual(1, sender.sent)
+
+    @gen_test
+    def test_pixel_counts_posts(self):
+        view_counts.start(db=None)
+        post_index._ready = True
+        post_index._published.add('the-slug')
+        for path in 'the-slug', 'other-slug':
+            yield self.http_client.fetch(self.get_url(
+                '/analytics/http://example.com/blog/%s//pixel.gif' % path))
+
+        self.assertEqual(
+            {('/blog/the-slug/', view_counts.today()): 1},
+            dict(view_counts._counts))
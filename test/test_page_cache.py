@@ -0,0 +1,318 @@
+import gzip
+import unittest
+from cStringIO import StringIO
+from datetime import datetime
+
+import mock
+from bson import ObjectId
+
+from motor_blog import cache
+from motor_blog.text import slugify
+from motor_blog.web import handlers, page_cache
+import test  # Motor-Blog project's test/__init__.py.
+
+
+class PageCacheTest(test.MotorBlogTest):
+    def test_page_cache(self):
+        post_id = self.new_post(title='the title', body='old body')
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        response = self.fetch(url)
+        self.assertEqual(200, response.code)
+        self.assertTrue('old body' in response.body)
+
+        # Modify the post behind the application's back: no event, so the
+        # cached page is served.
+        self.sync_db.posts.update(
+            {'_id': ObjectId(post_id)},
+            {'$set': {'body': 'new body'}})
+
+        response = self.fetch(url)
+        self.assertTrue('old body' in response.body)
+        self.assertEqual(304, self.fetch(url, headers={
+            'If-Modified-Since': response.headers['Last-Modified']}).code)
+
+        # An event evicts the page.
+        cache._on_event({'name': 'post_changed'})
+        response = self.fetch(url)
+        self.assertTrue('new body' in response.body)
+
+    def test_uncached_not_found(self):
+        url = self.reverse_url('post', 'nonexistent')
+        self.assertEqual(404, self.fetch(url).code)
+        self.new_post(title='nonexistent')
+        self.assertEqual(200, self.fetch(url).code)
+
+    def test_targeted_eviction(self):
+        page_id = self.new_page(title='about', body='about body')
+        post_id = self.new_post(title='post', body='post body')
+        page_url = self.reverse_url('post', 'about')
+        post_url = self.reverse_url('post', 'post')
+        self.fetch(page_url)
+        self.fetch(post_url)
+
+        # Change the page behind the application's back.
+        self.sync_db.posts.update(
+            {'_id': ObjectId(page_id)},
+            {'$set': {'body': 'new about body'}})
+
+        # Editing the post evicts its page but not the unrelated page.
+        self.edit_post(post_id, title='post', body='edited post body')
+        self.assertTrue('edited post body' in self.fetch(post_url).body)
+        self.assertTrue('about body' in self.fetch(page_url).body)
+        self.assertFalse('new about body' in self.fetch(page_url).body)
+
+
+class ValidatorTest(test.MotorBlogTest):
+    def tearDown(self):
+        page_cache.configure(64 * 1024 * 1024)
+        super(ValidatorTest, self).tearDown()
+
+    def test_not_modified_without_rendering(self):
+        # Keep no page bodies, but validators are still kept.
+        page_cache.configure(0)
+        post_id = self.new_post(title='the title', body='the body')
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        response = self.fetch(url)
+        etag = response.headers['Etag']
+        last_modified = response.headers['Last-Modified']
+
+        with mock.patch.object(
+                handlers.PostHandler, 'get',
+                side_effect=Exception('rendered')):
+            self.assertEqual(304, self.fetch(url, headers={
+                'If-None-Match': etag}).code)
+
+            self.assertEqual(304, self.fetch(url, headers={
+                'If-Modified-Since': last_modified}).code)
+
+        self.assertEqual(200, self.fetch(url, headers={
+            'If-Modified-Since': 'yesterday'}).code)
+
+        # Editing the post evicts its validator.
+        self.edit_post(post_id, title='the title', body='new body')
+        response = self.fetch(url, headers={'If-None-Match': etag})
+        self.assertEqual(200, response.code)
+        self.assertNotEqual(etag, response.headers['Etag'])
+
+
+class ValidatorIndexTest(unittest.TestCase):
+    def tearDown(self):
+        page_cache.invalidate()
+        page_cache.configure(64 * 1024 * 1024)
+
+    def test_index(self):
+        page_cache.configure(0)
+        page = page_cache.CachedPage(
+            'a' * page_cache.MIN_COMPRESS_LENGTH, None, ['k'])
+
+        page_cache.put(('/a',), page)
+        self.assertEqual(None, page_cache.get(('/a',)))
+        self.assertEqual({}, page.encoded)
+        validator = page_cache.get_validator(('/a',))
+        self.assertEqual(page.etag, validator.etag)
+
+        page_cache.invalidate({
+            'name': 'post_changed',
+            'posts': [{
+                'id': 'k', 'type': 'page',
+                'status': 'publish', 'old_status': 'publish'}]})
+
+        # Not evicted, 'k' isn't the post's key.
+        self.assertTrue(page_cache.get_validator(('/a',)))
+        page_cache.put(('/b',), page_cache.CachedPage(
+            'b', None, [page_cache.post_key('k')]))
+
+        page_cache.invalidate({
+            'name': 'post_changed',
+            'posts': [{
+                'id': 'k', 'type': 'page',
+                'status': 'publish', 'old_status': 'publish'}]})
+
+        self.assertTrue(page_cache.get_validator(('/a',)))
+        self.assertEqual(None, page_cache.get_validator(('/b',)))
+        self.assertFalse(page_cache.post_key('k') in page_cache._page_keys)
+
+    def test_put_again(self):
+        page_cache.put(('/a',), page_cache.CachedPage('a', None, ['j', 'k']))
+        page_cache.put(('/a',), page_cache.CachedPage('b', None, ['k']))
+        self.assertFalse('j' in page_cache._page_keys)
+        self.assertEqual(set([('/a',)]), page_cache._page_keys['k'])
+
+    def test_generation(self):
+        # A page rendered before an invalidation isn't cached after it.
+        generation = page_cache.generation()
+        page_cache.invalidate()
+        page_cache.put(('/a',), page_cache.CachedPage('a', None), generation)
+        self.assertEqual(None, page_cache.get_validator(('/a',)))
+
+        generation = page_cache.generation()
+        page_cache.put(('/a',), page_cache.CachedPage('a', None), generation)
+        self.assertTrue(page_cache.get_validator(('/a',)))
+
+    def test_evictions(self):
+        evictions = page_cache.evictions()
+        page_cache.evict([page_cache.post_key('slug')])
+        self.assertEqual(evictions, page_cache.evictions())
+
+        page_cache.put(('/a',), page_cache.CachedPage(
+            'a', None, [page_cache.post_key('slug')]))
+        page_cache.evict([page_cache.post_key('slug')])
+        self.assertEqual(evictions + 1, page_cache.evictions())
+
+
+class CompressionTest(unittest.TestCase):
+    body = 'x' * page_cache.MIN_COMPRESS_LENGTH
+
+    def test_variant(self):
+        page = page_cache.CachedPage(self.body, None)
+        self.assertEqual((None, self.body), page.variant('gzip'))
+        page.compress()
+        self.assertEqual((None, self.body), page.variant(None))
+        self.assertEqual((None, self.body), page.variant('identity'))
+        self.assertEqual((None, self.body), page.variant('gzip;q=0'))
+        encoding, body = page.variant('deflate, gzip;q=0.5')
+        self.assertEqual('gzip', encoding)
+        self.assertEqual(
+            self.body, gzip.GzipFile(fileobj=StringIO(body)).read())
+
+        self.assertEqual(page.size, len(self.body) + len(body))
+
+    def test_short(self):
+        page = page_cache.CachedPage('short', None)
+        page.compress()
+        self.assertEqual((None, 'short'), page.variant('gzip'))
+
+    @unittest.skipUnless(page_cache.brotli, 'brotli not installed')
+    def test_brotli(self):
+        page = page_cache.CachedPage(self.body, None)
+        page.compress()
+        encoding, body = page.variant('gzip, br')
+        self.assertEqual('br', encoding)
+        self.assertEqual(self.body, page_cache.brotli.decompress(body))
+
+
+class CompressedPageTest(test.MotorBlogTest):
+    def test_compressed_page(self):
+        self.new_post(title='the title', body='the body ' * 200)
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        for _ in range(2):
+            # Rendered, then from the page cache.
+            response = self.fetch(
+                url, headers={'Accept-Encoding': 'gzip'},
+                decompress_response=False)
+
+            self.assertEqual('gzip', response.headers['Content-Encoding'])
+            html = gzip.GzipFile(fileobj=StringIO(response.body)).read()
+            self.assertTrue('the body the body' in html)
+
+        response = self.fetch(url, decompress_response=False)
+        self.assertFalse('Content-Encoding' in response.headers)
+        self.assertTrue('the body the body' in response.body)
+
+
+class StalePageTest(test.MotorBlogTest):
+    def get_app(self):
+        self.set_option('page_cache_stale_grace', 60)
+        return super(StalePageTest, self).get_app()
+
+    def tearDown(self):
+        page_cache.configure(64 * 1024 * 1024)
+        super(StalePageTest, self).tearDown()
+
+    def test_serve_stale_on_error(self):
+        self.new_post(title='the title', body='the body')
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        self.assertEqual(200, self.fetch(url).code)
+        cache._on_event({'name': 'post_changed'})
+
+        with mock.patch.object(
+                handlers.PostHandler, 'get_categories',
+                side_effect=Exception('database down')):
+            response = self.fetch(url)
+
+        self.assertEqual(200, response.code)
+        self.assertTrue('the body' in response.body)
+
+    def test_refresh_in_background(self):
+        post_id = self.new_post(title='the title', body='old body')
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        self.fetch(url)
+        self.sync_db.posts.update(
+            {'_id': ObjectId(post_id)}, {'$set': {'body': 'new body'}})
+
+        cache._on_event({'name': 'post_changed'})
+
+        # The stale page is served while it's re-rendered.
+        self.assertTrue('old body' in self.fetch(url).body)
+        for _ in range(100):
+            if 'new body' in self.fetch(url).body:
+                break
+        else:
+            self.fail('Stale page not refreshed')
+
+    def test_unpublished_while_stale(self):
+        post_id = self.new_post(title='the title', body='the body')
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        self.fetch(url)
+        self.sync_db.posts.update(
+            {'_id': ObjectId(post_id)}, {'$set': {'status': 'draft'}})
+
+        cache._on_event({'name': 'post_changed'})
+
+        # The re-render is a 404, so the stale page is forgotten.
+        self.assertEqual(200, self.fetch(url).code)
+        for _ in range(100):
+            response = self.fetch(url)
+            if response.code == 404:
+                break
+        else:
+            self.fail('Stale page still served')
+
+        self.assertEqual(None, page_cache.get((url,)))
+
+
+class SurrogateKeysTest(unittest.TestCase):
+    def info(self, **kwargs):
+        info = {
+            'id': 1, 'type': 'post',
+            'status': 'publish', 'old_status': 'publish',
+            'pub_date': datetime(2014, 1, 1),
+            'old_pub_date': datetime(2014, 1, 1),
+            'tags': ['a', 'b'], 'old_tags': ['a', 'b'],
+            'categories': ['c'], 'old_categories': ['c']}
+
+        info.update(kwargs)
+        return {'name': 'post_changed', 'posts': [info]}
+
+    def test_flush_all(self):
+        self.assertEqual(
+            None,
+            page_cache.surrogate_keys_for_event({'name': 'post_changed'}))
+
+    def test_draft(self):
+        self.assertEqual(set(), page_cache.surrogate_keys_for_event(
+            self.info(status='draft', old_status='draft')))
+
+    def test_edit(self):
+        self.assertEqual(
+            set([page_cache.post_key(1)]),
+            page_cache.surrogate_keys_for_event(self.info()))
+
+    def test_retag(self):
+        self.assertEqual(
+            set([page_cache.post_key(1),
+                 page_cache.tag_key('b'),
+                 page_cache.tag_key('new tag')]),
+            page_cache.surrogate_keys_for_event(
+                self.info(tags=['a', 'new tag'])))
+
+    def test_publish(self):
+        self.assertEqual(
+            set([page_cache.post_key(1),
+                 page_cache.LIST_KEY,
+                 page_cache.NAV_KEY,
+                 page_cache.tag_key('a'),
+                 page_cache.tag_key('b'),
+                 page_cache.category_key('c')]),
+            page_cache.surrogate_keys_for_event(
+                self.info(old_status='draft')))
@@ -0,0 +1,83 @@
+import datetime
+import unittest
+
+from bson import ObjectId
+from bs4 import BeautifulSoup
+import tornado.web
+
+from motor_blog.web import handlers
+import test  # Motor-Blog project's test/__init__.py.
+
+
+class PageCursorTest(unittest.TestCase):
+    def test_page_cursor(self):
+        pub_date = datetime.datetime(2012, 11, 3, 12, 30, 1, 123000)
+        _id = ObjectId()
+        cursor = handlers.page_cursor(pub_date, _id)
+        self.assertEqual(
+            (pub_date, _id), handlers.parse_page_cursor(cursor))
+
+    def test_bad_page_cursor(self):
+        for cursor in ('', 'foo', '1-foo', 'x-%s' % ObjectId()):
+            with self.assertRaises(tornado.web.HTTPError) as context:
+                handlers.parse_page_cursor(cursor)
+
+            self.assertEqual(400, context.exception.status_code)
+
+
+class PaginationTest(test.MotorBlogTest):
+    def links(self, url):
+        response = self.fetch(url)
+        self.assertEqual(200, response.code)
+        soup = BeautifulSoup(response.body)
+        titles = [h1.text.strip() for h1 in soup.find_all('h1', 'title')]
+
+        def href(css_class):
+            div = soup.find('div', css_class)
+            return div.find('a')['href'] if div else None
+
+        return titles, href('nav-previous'), href('nav-next')
+
+    def test_pagination(self):
+        start = datetime.datetime(2014, 1, 1)
+        for i in range(25):
+            self.new_post(
+                title='title %d' % i,
+                created=start + datetime.timedelta(hours=i))
+
+        # Posts with the same pub_date are ordered by _id.
+        self.sync_db.posts.update(
+            {}, {'$set': {'pub_date': start}}, multi=True)
+
+        self.posts_changed()
+        titles, older, newer = self.links(self.reverse_url('home'))
+        self.assertEqual(['title %d' % i for i in range(24, 14, -1)], titles)
+        self.assertEqual(None, newer)
+
+        titles, older, newer = self.links(older)
+        self.assertEqual(['title %d' % i for i in range(14, 4, -1)], titles)
+
+        titles, older, last_newer = self.links(older)
+        self.assertEqual(['title %d' % i for i in range(4, -1, -1)], titles)
+        self.assertEqual(None, older)
+
+        titles, older, newer = self.links(last_newer)
+        self.assertEqual(['title %d' % i for i in range(14, 4, -1)], titles)
+
+        # The first page has a canonical URL.
+        response = self.fetch(newer, follow_redirects=False)
+        self.assertEqual(302, response.code)
+        self.assertEqual(
+            self.reverse_url('home'), response.headers['Location'])
+
+    def test_page_number_fallback(self):
+        for i in range(15):
+            self.new_post(
+                title='title %d' % i,
+                created=datetime.datetime(2014, 1, 1 + i))
+
+        titles, older, newer = self.links(self.reverse_url('page', 1))
+        self.assertEqual(['title %d' % i for i in range(4, -1, -1)], titles)
+        self.assertEqual(None, older)
+        titles, _, _ = self.links(newer)
+        self.assertEqual(['title %d' % i for i in range(14, 4, -1)], titles)
@@ -0,0 +1,93 @@
+import datetime
+import unittest
+
+from bson import ObjectId
+from bs4 import BeautifulSoup
+
+from motor_blog.models import Post, post_event_info
+from motor_blog.web import post_index
+import test  # Motor-Blog project's test/__init__.py.
+
+
+def make_post(title, day, status='publish'):
+    return Post(
+        id=ObjectId(), title=title, slug=title, status=status,
+        pub_date=datetime.datetime(2014, 1, day),
+        mod=datetime.datetime(2014, 1, day))
+
+
+class PostIndexTest(unittest.TestCase):
+    def setUp(self):
+        # Pretend the index was loaded from an empty collection.
+        post_index._db = object()
+        post_index._ready = True
+
+    def tearDown(self):
+        post_index.unload()
+
+    def event(self, name, new=None, old=None):
+        post_index._on_event({
+            'name': name, 'posts': [post_event_info(new, old)]})
+
+    def titles(self, posts):
+        return [post.title if post else None for post in posts]
+
+    def test_index(self):
+        a, b, c = make_post('a', 1), make_post('b', 2), make_post('c', 3)
+        for post in c, a, b:
+            self.event('post_created', post)
+
+        self.assertEqual(
+            ['c', 'b', 'a'], self.titles(post_index.newest(0, 10)))
+
+        self.assertEqual(['b'], self.titles(post_index.newest(1, 1)))
+        self.assertEqual(
+            ['a', 'c'],
+            self.titles(post_index.neighbors(b.pub_date, b.id)))
+
+        self.assertEqual(
+            [None, 'b'],
+            self.titles(post_index.neighbors(a.pub_date, a.id)))
+
+        # Move b after c.
+        new_b = make_post('new b', 4)
+        new_b.id = b.id
+        self.event('post_changed', new_b, b)
+        self.assertEqual(
+            ['new b', 'c', 'a'], self.titles(post_index.newest(0, 10)))
+
+        # Unpublish c, delete a.
+        draft_c = make_post('c', 3, 'draft')
+        draft_c.id = c.id
+        self.event('post_changed', draft_c, c)
+        self.event('post_deleted', old=a)
+        self.assertEqual(['new b'], self.titles(post_index.newest(0, 10)))
+        self.assertTrue(post_index.published(new_b.slug))
+        self.assertFalse(post_index.published(c.slug))
+
+    def test_not_loaded(self):
+        post_index.unload()
+        self.event('post_created', make_post('a', 1))
+        self.assertEqual(None, post_index.newest(0, 10))
+        self.assertEqual(None, post_index.published('a'))
+        self.assertEqual(None, post_index.neighbors(
+            datetime.datetime(2014, 1, 1), ObjectId()))
+
+
+class PostIndexNavigationTest(test.MotorBlogTest):
+    def tearDown(self):
+        post_index.unload()
+        super(PostIndexNavigationTest, self).tearDown()
+
+    def test_navigation(self):
+        self.new_post(title='a')
+        self.io_loop.run_sync(lambda: post_index.load(self.get_db()))
+        self.assertEqual(1, len(post_index.newest(0, 10)))
+
+        # Added to the index from the post_created event.
+        self.new_post(title='b')
+        self.new_post(title='c')
+        self.assertEqual(3, len(post_index.newest(0, 10)))
+        soup = BeautifulSoup(self.fetch(self.reverse_url('post', 'b')).body)
+        self.assertEqual('a', soup.find('a', rel='prev').text.strip())
+        self.assertEqual('c', soup.find('a', rel='next').text.strip())
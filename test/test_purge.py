@@ -0,0 +1,144 @@
+import datetime
+import urllib
+
+import mock
+import tornado.web
+from bson import ObjectId
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from motor_blog.models import Post, post_event_info
+from motor_blog.web import page_cache
+from motor_blog.web.purge import Purger
+
+
+class ProxyHandler(tornado.web.RequestHandler):
+    """Stands in for a front proxy, records purge requests."""
+    SUPPORTED_METHODS = ('PURGE', 'BAN')
+
+    def initialize(self, requests, failures):
+        self.requests = requests
+        self.failures = failures
+
+    def purge(self, path):
+        if self.failures:
+            raise tornado.web.HTTPError(self.failures.pop())
+
+        self.requests.append((
+            self.request.method,
+            self.request.path,
+            self.request.headers.get('Surrogate-Key')))
+
+    ban = purge
+
+
+def reverse_url(name, *args):
+    return '/blog/%s/%s' % (name, '/'.join(urllib.quote(a) for a in args))
+
+
+class PurgeTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.requests = []
+        self.failures = []
+        super(PurgeTest, self).setUp()
+
+    def get_app(self):
+        application = tornado.web.Application([
+            ('(.*)', ProxyHandler,
+             {'requests': self.requests, 'failures': self.failures})],
+            host='example.com')
+
+        # Purger only uses reverse_url() and settings.
+        application.reverse_url = reverse_url
+        return application
+
+    def purger(self, **kwargs):
+        return Purger(
+            self._app, [self.get_url('/')], delay=0, backoff=0.01, **kwargs)
+
+    def event(self, post=None, old=None):
+        if post is None and old is None:
+            return {'name': 'categories_changed'}
+
+        return {
+            'name': 'post_changed', 'posts': [post_event_info(post, old)]}
+
+    def post(self, **kwargs):
+        fields = dict(
+            id=ObjectId('5095b71e8a1d9b3bb3aa0f1b'), slug='the-slug',
+            tags=['a tag'], pub_date=datetime.datetime(2014, 1, 1),
+            mod=datetime.datetime(2014, 1, 1))
+
+        fields.update(kwargs)
+        return Post(**fields)
+
+    @gen_test
+    def test_keys(self):
+        purger = self.purger()
+        old = self.post()
+        purger.on_event(self.event(self.post(tags=['new tag']), old))
+        purger.on_event(self.event(self.post(title='new title'), old))
+        yield purger.flush()
+        self.assertEqual([(
+            'PURGE', '/',
+            ' '.join(sorted([
+                page_cache.post_key(old.id),
+                page_cache.tag_key('a tag'),
+                page_cache.tag_key('new tag')])))],
+            self.requests)
+
+    @gen_test
+    def test_all(self):
+        purger = self.purger(method='BAN')
+        purger.on_event(self.event())
+        yield purger.flush()
+        self.assertEqual([('BAN', '/', page_cache.ALL_KEY)], self.requests)
+
+    @gen_test
+    def test_by_url(self):
+        purger = self.purger(by_url=True)
+        purger.on_event(self.event(
+            self.post(slug='new-slug', tags=['new tag']), self.post()))
+
+        yield purger.flush()
+        self.assertEqual(sorted([
+            reverse_url('post', 'new-slug'),
+            reverse_url('post', 'the-slug'),
+            reverse_url('tag', 'a tag'),
+            reverse_url('tag', 'new tag'),
+            reverse_url('tag-feed', 'a tag'),
+            reverse_url('tag-feed', 'new tag'),
+            reverse_url('tag-feed-json', 'a tag'),
+            reverse_url('tag-feed-json', 'new tag'),
+            reverse_url('tag-feed-rss', 'a tag'),
+            reverse_url('tag-feed-rss', 'new tag'),
+        ]), sorted(path for _, path, _ in self.requests))
+
+    @gen_test
+    def test_retry(self):
+        purger = self.purger()
+        self.failures.extend([503, 503])
+        purger.on_event(self.event(self.post(title='new title'), self.post()))
+        yield purger.flush()
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual([], self.failures)
+
+    @gen_test
+    def test_give_up(self):
+        purger = self.purger()
+        self.failures.extend([503] * 10)
+        purger.on_event(self.event(self.post(title='new title'), self.post()))
+        yield purger.flush()
+        self.assertEqual([], self.requests)
+        self.assertEqual(6, len(self.failures))
+
+    @gen_test
+    def test_not_cached(self):
+        purger = self.purger()
+        self.failures.extend([503, 404])
+        purger.on_event(self.event(self.post(title='new title'), self.post()))
+        with mock.patch('logging.error') as error:
+            yield purger.flush()
+
+        # Not retried, nor logged as an error.
+        self.assertEqual([503], self.failures)
+        self.assertFalse(error.called)
@@ -0,0 +1,77 @@
+import datetime
+
+from bs4 import BeautifulSoup
+
+from motor_blog.text import slugify
+from motor_blog.web import rankings, view_counts
+import test  # Motor-Blog project's test/__init__.py.
+
+
+class RankingsTest(test.MotorBlogTest):
+    def tearDown(self):
+        rankings.stop()
+        super(RankingsTest, self).tearDown()
+
+    def set_views(self, title, views, days_ago=0):
+        path = self.reverse_url('post', slugify.slugify(title))
+        day = view_counts.today() - datetime.timedelta(days=days_ago)
+        self.sync_db.views.update(
+            {'path': path, 'day': day}, {'$set': {'views': views}},
+            upsert=True)
+
+    def refresh(self):
+        self.io_loop.run_sync(rankings.refresh)
+
+    def popular_titles(self):
+        soup = BeautifulSoup(self.fetch(
+            self.reverse_url('post', 'widget-post')).body)
+
+        post_list = soup.find('ul', attrs={'class': 'post-list'})
+        return [
+            a.text
+            for a in post_list.find_all('a', attrs={'class': 'summary-title'})]
+
+    def test_popular_posts(self):
+        for i, title in enumerate(['ada', 'foo', 'bar']):
+            self.new_post(
+                title=title, created=datetime.datetime(2014, 1, i + 1))
+
+        self.new_post(
+            title='widget post',
+            body='!!popular-posts 2 7d!!',
+            created=datetime.datetime(2014, 1, 4))
+
+        self.set_views('ada', 10)
+        self.set_views('foo', 5)
+        self.set_views('foo', 100, days_ago=10)
+        self.set_views('bar', 20, days_ago=3)
+
+        # Other pages' views aren't ranked.
+        self.sync_db.views.insert({
+            'path': self.reverse_url('home'), 'day': view_counts.today(),
+            'views': 1000})
+
+        # Not ranking.
+        self.assertEqual(None, rankings.popular(7))
+        self.assertEqual([], self.popular_titles())
+
+        rankings.start(self._app, interval=3600)
+        self.assertEqual(None, rankings.popular(7))
+        self.refresh()
+        self.assertEqual(
+            ['bar', 'ada', 'foo'],
+            [post.title for post in rankings.popular(7)])
+
+        # Each window is ranked once a widget asks for it.
+        self.assertEqual(None, rankings.popular(30))
+        self.refresh()
+        self.assertEqual(
+            ['foo', 'bar', 'ada'],
+            [post.title for post in rankings.popular(30)])
+
+        self.assertEqual(['bar', 'ada'], self.popular_titles())
+
+        # New rankings evict the page.
+        self.set_views('ada', 30)
+        self.refresh()
+        self.assertEqual(['ada', 'bar'], self.popular_titles())
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import tornado.web
+
+from motor_blog.web import templates
+import test  # Motor-Blog project's test/__init__.py, patches Tornado for Jade.
+
+
+class CompileTemplatesTest(unittest.TestCase):
+    def setUp(self):
+        self.template_path = tempfile.mkdtemp()
+        self.module_dir = os.path.join(self.template_path, 'modules')
+        self.write('base.jade', 'h1= title\nblock content\n')
+        self.write(
+            'page.jade',
+            'extends base\nblock content\n    p= setting("name")\n')
+
+    def tearDown(self):
+        tornado.web.RequestHandler._template_loaders.pop(
+            self.template_path, None)
+
+        shutil.rmtree(self.template_path)
+
+    def write(self, name, source):
+        with open(os.path.join(self.template_path, name), 'w') as f:
+            f.write(source)
+
+    def compile_with_modules(self):
+        return templates.compile_all(
+            self.template_path, module_dir=self.module_dir)
+
+    def render(self, loader):
+        return loader.load('page.jade').generate(
+            title='the title', setting=lambda name: name + ' setting')
+
+    def test_compile_all(self):
+        loader = templates.compile_all(self.template_path)
+        self.assertEqual(['base.jade', 'page.jade'], sorted(loader.templates))
+        self.assertTrue(
+            loader is
+            tornado.web.RequestHandler._template_loaders[self.template_path])
+
+        self.assertEqual(
+            '<h1>the title</h1>\n<p>name setting</p>', self.render(loader))
+
+    def test_modules(self):
+        loader = self.compile_with_modules()
+        self.assertFalse(isinstance(
+            loader.load('page.jade'), templates._GeneratedTemplate))
+
+        self.assertTrue(
+            os.path.exists(os.path.join(self.module_dir, 'page_jade.py')))
+
+        # Next startup loads the generated modules.
+        loader = self.compile_with_modules()
+        self.assertTrue(isinstance(
+            loader.load('page.jade'), templates._GeneratedTemplate))
+
+        self.assertEqual(
+            '<h1>the title</h1>\n<p>name setting</p>', self.render(loader))
+
+        # Changing any template regenerates all modules.
+        self.write('base.jade', 'h2= title\nblock content\n')
+        loader.reset()
+        self.assertFalse(isinstance(
+            loader.load('page.jade'), templates._GeneratedTemplate))
+
+        self.assertEqual(
+            '<h2>the title</h2>\n<p>name setting</p>', self.render(loader))
+
+        loader = self.compile_with_modules()
+        self.assertFalse(isinstance(
+            loader.load('page.jade'), templates._GeneratedTemplate))
+
+        loader = self.compile_with_modules()
+        self.assertEqual(
+            '<h2>the title</h2>\n<p>name setting</p>', self.render(loader))
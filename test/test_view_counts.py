@@ -0,0 +1,107 @@
+import datetime
+import unittest
+
+import mock
+from pymongo.errors import BulkWriteError
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from motor_blog.text import slugify
+from motor_blog.web import lytics, post_index, view_counts
+import test  # Motor-Blog project's test/__init__.py.
+
+
+class CountTest(unittest.TestCase):
+    def tearDown(self):
+        view_counts.stop()
+
+    def test_count(self):
+        # Not counting until start().
+        view_counts.count('/blog/the-slug/')
+        self.assertFalse(view_counts._counts)
+
+        view_counts.start(db=None)
+        view_counts.count('/blog/the-slug/')
+        view_counts.count('/blog/the-slug/')
+        self.assertEqual(
+            {('/blog/the-slug/', view_counts.today()): 2},
+            dict(view_counts._counts))
+
+
+class FlushErrorTest(AsyncTestCase):
+    def tearDown(self):
+        view_counts.stop()
+        super(FlushErrorTest, self).tearDown()
+
+    @gen_test
+    def test_write_errors(self):
+        @gen.coroutine
+        def bulk_write(requests, ordered):
+            raise BulkWriteError({'writeErrors': [
+                {'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]})
+
+        db = mock.Mock()
+        db.views.bulk_write.side_effect = bulk_write
+        view_counts.start(db, interval=3600)
+        view_counts.count('/a/')
+        view_counts.count('/b/')
+        view_counts.count('/b/')
+        view_counts.count('/c/')
+        yield view_counts.flush(db)
+
+        # Only the failed update is retried.
+        self.assertEqual(
+            {('/b/', view_counts.today()): 2}, dict(view_counts._counts))
+
+
+class ViewCountsTest(test.MotorBlogTest):
+    def setUp(self):
+        super(ViewCountsTest, self).setUp()
+        self._app.settings['count_page_views'] = True
+        view_counts.start(self.get_db(), interval=3600)
+
+    def tearDown(self):
+        view_counts.stop()
+        post_index.unload()
+        super(ViewCountsTest, self).tearDown()
+
+    def flush(self):
+        self.io_loop.run_sync(lambda: view_counts.flush(self.get_db()))
+
+    def views(self, **kwargs):
+        return self.io_loop.run_sync(
+            lambda: view_counts.views(self.get_db(), **kwargs))
+
+    def test_views(self):
+        self.new_post(title='the title')
+        self.new_post(title='other title')
+        url = self.reverse_url('post', slugify.slugify('the title'))
+        other_url = self.reverse_url('post', slugify.slugify('other title'))
+        for _ in range(2):
+            self.assertEqual(200, self.fetch(url).code)
+
+        self.flush()
+
+        # The feed's tracking pixel counts as a view of the same path, once
+        # the post index knows the post is published.
+        self.io_loop.run_sync(lambda: post_index.load(self.get_db()))
+        self.fetch(lytics.ga_track_event_url(
+            self._app, self.reverse_url_absolute('post', 'the-title')))
+
+        self.fetch(lytics.ga_track_event_url(
+            self._app, self.reverse_url_absolute('post', 'nonexistent')))
+
+        self.fetch(other_url)
+
+        # Feeds and missing pages aren't counted.
+        self.fetch(self.reverse_url('feed'))
+        self.fetch(self.reverse_url('post', 'nonexistent'))
+        self.flush()
+
+        self.assertEqual([(url, 3), (other_url, 1)], self.views())
+        self.assertEqual([(url, 3)], self.views(limit=1))
+
+        tomorrow = view_counts.today() + datetime.timedelta(days=1)
+        self.assertEqual([], self.views(since=tomorrow))
+        self.assertEqual(
+            1, self.sync_db.views.find({'path': url}).count())
@@ -0,0 +1,48 @@
+import tornado.web
+from tornado.testing import AsyncTestCase, gen_test
+
+from motor_blog.web import page_cache, warmer
+import test  # Motor-Blog project's test/__init__.py.
+
+
+class RenderTest(AsyncTestCase):
+    @gen_test
+    def test_render(self):
+        uris = []
+
+        class Handler(tornado.web.RequestHandler):
+            def get(self):
+                uris.append(self.request.uri)
+                self.write('hello')
+
+        application = tornado.web.Application(
+            [('/page', Handler)], host='example.com')
+
+        yield warmer.render(application, '/page?a=1')
+        yield warmer.render(application, '/nonexistent')
+        self.assertEqual(['/page?a=1'], uris)
+
+
+class WarmerTest(test.MotorBlogTest):
+    def test_hot_uris(self):
+        category_id = self.new_category('Category Name')
+        post_id = self.new_post(title='the title', tag='a tag,other tag')
+        self.new_post(title='another', tag='a tag')
+        self.set_categories(post_id, [category_id])
+
+        uris = self.io_loop.run_sync(
+            lambda: warmer.hot_uris(self._app, pages=2, tags=1))
+
+        self.assertEqual([
+            self.reverse_url('home'),
+            self.reverse_url('feed'),
+            self.reverse_url('category', 'category-name'),
+            self.reverse_url('category-feed', 'category-name'),
+            self.reverse_url('tag', 'a tag'),
+        ], uris)
+
+        self.io_loop.run_sync(lambda: warmer.warm(self._app, uris, 2))
+        home = page_cache.get((self.reverse_url('home'),))
+        self.assertTrue(home)
+        self.assertTrue('the title' in home.body)
+        self.assertTrue(page_cache.get((self.reverse_url('tag', 'a tag'),)))
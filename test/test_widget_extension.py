@@ -3,8 +3,14 @@ from datetime import datetime
 
 from bs4 import BeautifulSoup
 from bson import ObjectId
+import mock
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
 
+from motor_blog import cache
+from motor_blog.text import markdown_widget_extension
 from motor_blog.text.markup import markup
+from motor_blog.web import widgets
 import test  # Motor-Blog project's test/__init__.py.
 
 
@@ -29,6 +35,70 @@ class WidgetMarkupTest(unittest.TestCase):
             widgets[0].text)
 
 
+class SegmentsTest(unittest.TestCase):
+    def test_segments(self):
+        self.assertEqual([], markdown_widget_extension.segments('<p>a</p>'))
+        self.assertEqual(
+            ['<p>', 'recent-posts 1', '</p><p>', 'foo bar', '</p>'],
+            markdown_widget_extension.segments(
+                '<p><widget>recent-posts 1</widget></p>'
+                '<p><widget>foo bar</widget></p>'))
+
+
+class RenderSegmentsTest(AsyncTestCase):
+    def setUp(self):
+        super(RenderSegmentsTest, self).setUp()
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+        @gen.coroutine
+        def slow(handler, db, text):
+            self.calls.append(text)
+            self.running += 1
+            self.max_running = max(self.running, self.max_running)
+            yield gen.sleep(0.01)
+            self.running -= 1
+            raise gen.Return((
+                '<b>%s</b>' % text, datetime(2014, 1, len(self.calls)),
+                frozenset(['key-' + text])))
+
+        patcher = mock.patch.dict(widgets.all_widgets, {'slow': slow})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache._on_event({'name': 'post_changed'})
+
+    @gen_test
+    def test_render_segments(self):
+        handler = mock.Mock()
+        segments = markdown_widget_extension.segments(
+            '<widget>slow a</widget> and <widget>slow b</widget>'
+            ' <widget>unknown</widget> <widget>slow a</widget>')
+
+        expected = '<b>a</b> and <b>b</b> <widget>unknown</widget> <b>a</b>'
+        rendered, modified = yield widgets.render_segments(
+            handler, None, segments)
+
+        self.assertEqual(expected, rendered)
+        self.assertEqual(datetime(2014, 1, 2), modified)
+
+        # Concurrent, and identical widgets render once.
+        self.assertEqual(['a', 'b'], sorted(self.calls))
+        self.assertEqual(2, self.max_running)
+        handler.add_surrogate_keys.assert_any_call('key-a')
+        handler.add_surrogate_keys.assert_any_call('key-b')
+
+        # Cached.
+        rendered, _ = yield widgets.render_segments(handler, None, segments)
+        self.assertEqual(expected, rendered)
+        self.assertEqual(2, len(self.calls))
+
+        # Post events clear the cache.
+        cache._on_event({'name': 'post_created'})
+        yield widgets.render_segments(handler, None, segments)
+        self.assertEqual(4, len(self.calls))
+
+
 class RecentPostsWidgetTest(test.MotorBlogTest):
     def get_app(self):
         # Configure the "home_page" option.
@@ -83,6 +153,8 @@ end text''')
                 {'_id': ObjectId(_id)},
                 {'$set': {'mod': mod_date}})
 
+            self.posts_changed()
+
         update(foo_id, datetime(2014, 1, 6))
         self.assert_modified(url, datetime(2014, 1, 6))
 
@@ -135,3 +207,17 @@ end text''')
         self.assertFalse(comes_after(tagged[0], 'start text'))
         self.assertTrue(comes_before(tagged[0], 'middle text'))
         self.assertTrue(comes_after(tagged[1], 'end text'))
+
+    def test_without_segments(self):
+        self.new_post(title='foo')
+        home_id = self.new_page(
+            title='test-home', body='start text\n\n!!recent-posts 1!!')
+
+        # Saved before Post.segments was added.
+        self.sync_db.posts.update(
+            {'_id': ObjectId(home_id)}, {'$unset': {'segments': 1}})
+
+        self.posts_changed()
+        soup = BeautifulSoup(self.fetch(self.reverse_url('home')).body)
+        post_list = soup.find('ul', attrs={'class', 'post-list'})
+        self.assertTrue('foo' in post_list.text)